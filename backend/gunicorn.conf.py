@@ -0,0 +1,18 @@
+# gunicorn.conf.py
+# Picked up automatically by `gunicorn` when started from this directory.
+import os
+
+
+def post_fork(server, worker):
+    # When uploads are processed in-process (no Celery broker), give every
+    # worker its own rembg session loaded before the first request needs it,
+    # and a sweeper that requeues jobs lost when a worker was recycled.
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'istak_backend.settings')
+    import django
+    django.setup()
+
+    from django.conf import settings
+    if settings.IMAGE_PROCESSING_BACKEND == "thread":
+        from istak_backend.imaging import start_stuck_image_sweeper, warm_rembg_session
+        warm_rembg_session()
+        start_stuck_image_sweeper()
@@ -0,0 +1,408 @@
+# analytics.py
+from collections import defaultdict
+from datetime import timedelta
+
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction as db_transaction
+from django.db.models import Count, F, Q, Sum, Window
+from django.db.models.functions import RowNumber, TruncDay, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .models import DailyTransactionRollup, Item, PredictiveItemCondition, Transaction
+
+TOP_ITEMS_PER_BUCKET = 5
+
+# Transaction statuses that have their own rollup counter
+STATUS_COUNTERS = ('returned', 'overdue')
+COUNTERS = ('borrowed',) + STATUS_COUNTERS
+
+
+def resolve_manager(user):
+    """Return the manager whose data `user` is allowed to see (None if unscoped)."""
+    if getattr(user, "role", None) == "user_web":
+        return user
+    return getattr(user, "manager", None)
+
+
+def overdue_q(today):
+    """
+    Loans overdue on `today`: marked 'overdue' by the sweep, or still
+    'borrowed' past their return date because no sweep has run since.
+    """
+    return Q(status='overdue') | Q(status='borrowed', return_date__lt=today)
+
+
+# ----------------------------
+# Rollup maintenance
+# ----------------------------
+
+def _apply_deltas(deltas):
+    """
+    Add `deltas` ({(manager_id, day, item_id): {counter: n}}) to the rollup
+    table. Missing rows are created first; the touched rows are then locked
+    and written back in one bulk_update. Call inside transaction.atomic().
+    """
+    deltas = {key: delta for key, delta in deltas.items() if any(delta.values())}
+    if not deltas:
+        return
+
+    DailyTransactionRollup.objects.bulk_create(
+        [DailyTransactionRollup(manager_id=m, day=d, item_id=i) for m, d, i in deltas],
+        ignore_conflicts=True,
+    )
+
+    manager_ids = {m for m, _, _ in deltas}
+    days = {d for _, d, _ in deltas}
+    item_ids = {i for _, _, i in deltas if i is not None}
+    rows = (
+        DailyTransactionRollup.objects.select_for_update()
+        .filter(manager_id__in=manager_ids, day__in=days)
+        .filter(Q(item__isnull=True) | Q(item_id__in=item_ids))
+    )
+
+    changed = []
+    for row in rows:
+        delta = deltas.get((row.manager_id, row.day, row.item_id))
+        if not delta:
+            continue
+        for counter, n in delta.items():
+            setattr(row, counter, getattr(row, counter) + n)
+        changed.append(row)
+    DailyTransactionRollup.objects.bulk_update(changed, COUNTERS)
+
+    # Anything that moves the rollups also moves the inventory summary card
+    invalidate_inventory_summary(manager_ids)
+
+
+def _transition_delta(n, old_status, new_status):
+    delta = defaultdict(int)
+    if old_status is None:
+        delta['borrowed'] += n
+    if new_status is None:
+        delta['borrowed'] -= n
+    if old_status in STATUS_COUNTERS:
+        delta[old_status] -= n
+    if new_status in STATUS_COUNTERS:
+        delta[new_status] += n
+    return delta
+
+
+def record_checkout(transaction, item_ids):
+    """Count a newly created transaction and its items in the rollups."""
+    record_checkouts([(transaction, item_ids)])
+
+
+def record_checkouts(checkouts):
+    """Count many new (transaction, item_ids) pairs with a single rollup write."""
+    deltas = defaultdict(lambda: defaultdict(int))
+    for transaction, item_ids in checkouts:
+        if transaction.manager_id is None:
+            continue
+        delta = _transition_delta(1, None, transaction.status)
+        for item_id in [None] + list(item_ids):
+            key = (transaction.manager_id, transaction.borrow_date, item_id)
+            for counter, n in delta.items():
+                deltas[key][counter] += n
+    _apply_deltas(deltas)
+
+
+def record_transition(transactions, old_status, new_status):
+    """
+    Move `transactions` (a queryset, all currently in `old_status`) to
+    `new_status` in the rollups. Use old_status=None for new transactions
+    and new_status=None for deleted ones. Must run before the status change
+    is written, in the same DB transaction.
+    """
+    transactions = transactions.filter(manager__isnull=False)
+    counts = {
+        (row['manager_id'], row['borrow_date'], None): row['n']
+        for row in transactions.values('manager_id', 'borrow_date').annotate(n=Count('id'))
+    }
+    per_item = (
+        Transaction.items.through.objects.filter(transaction__in=transactions)
+        .values('transaction__manager_id', 'transaction__borrow_date', 'item_id')
+        .annotate(n=Count('id'))
+    )
+    for row in per_item:
+        key = (row['transaction__manager_id'], row['transaction__borrow_date'], row['item_id'])
+        counts[key] = row['n']
+
+    _apply_deltas({
+        key: _transition_delta(n, old_status, new_status) for key, n in counts.items()
+    })
+
+
+def rebuild_rollups(manager=None, batch_size=1000):
+    """Recompute the rollup table from transaction history. Returns rows written."""
+    transactions = Transaction.objects.filter(manager__isnull=False)
+    rollups = DailyTransactionRollup.objects.all()
+    if manager is not None:
+        transactions = transactions.filter(manager=manager)
+        rollups = rollups.filter(manager=manager)
+
+    status_counts = {
+        'borrowed': Count('id'),
+        'returned': Count('id', filter=Q(status='returned')),
+        'overdue': Count('id', filter=Q(status='overdue')),
+    }
+    rows = [
+        DailyTransactionRollup(manager_id=row['manager_id'], day=row['borrow_date'],
+                               **{c: row[c] for c in COUNTERS})
+        for row in transactions.values('manager_id', 'borrow_date').annotate(**status_counts)
+    ]
+
+    through_counts = {
+        'borrowed': Count('id'),
+        'returned': Count('id', filter=Q(transaction__status='returned')),
+        'overdue': Count('id', filter=Q(transaction__status='overdue')),
+    }
+    per_item = (
+        Transaction.items.through.objects.filter(transaction__in=transactions)
+        .values('transaction__manager_id', 'transaction__borrow_date', 'item_id')
+        .annotate(**through_counts)
+    )
+    rows.extend(
+        DailyTransactionRollup(manager_id=row['transaction__manager_id'],
+                               day=row['transaction__borrow_date'], item_id=row['item_id'],
+                               **{c: row[c] for c in COUNTERS})
+        for row in per_item
+    )
+
+    rollups.delete()
+    DailyTransactionRollup.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
+
+
+# ----------------------------
+# Chart queries
+# ----------------------------
+
+def scoped_rollups(manager=None):
+    """Rollup rows for `manager` (all managers if None)."""
+    rollups = DailyTransactionRollup.objects.all()
+    if manager is not None:
+        rollups = rollups.filter(manager=manager)
+    return rollups
+
+
+def still_borrowed():
+    """Expression for loans in a rollup that are still in 'borrowed' status."""
+    return Sum('borrowed') - Sum('returned') - Sum('overdue')
+
+
+def _bucket_rollup(rollups, trunc, start, key_format, key_name, limit):
+    """
+    Count borrows per bucket and pick the top items of every bucket with
+    two grouped queries over the daily rollups. Rows returned are bounded
+    by buckets * TOP_ITEMS_PER_BUCKET, independent of transaction history.
+    """
+    scoped = rollups.filter(day__gte=start)
+
+    counts = (
+        scoped.filter(item__isnull=True)
+        .annotate(bucket=trunc("day"))
+        .values("bucket")
+        .annotate(count=Sum("borrowed"))
+        .filter(count__gt=0)
+        .order_by("bucket")
+    )
+
+    top_items = (
+        scoped.filter(item__isnull=False)
+        .annotate(bucket=trunc("day"))
+        .values("bucket", "item__item_name")
+        .annotate(count=Sum("borrowed"))
+        .filter(count__gt=0)
+        .annotate(
+            rank=Window(
+                RowNumber(),
+                partition_by=[F("bucket")],
+                order_by=[F("count").desc(), F("item__item_name").asc()],
+            )
+        )
+        .filter(rank__lte=TOP_ITEMS_PER_BUCKET)
+        .order_by("bucket", "rank")
+    )
+
+    items_by_bucket = {}
+    for row in top_items:
+        items_by_bucket.setdefault(row["bucket"], []).append(
+            {"item": row["item__item_name"], "count": row["count"]}
+        )
+
+    result = [
+        {
+            key_name: row["bucket"].strftime(key_format),
+            "count": row["count"],
+            "top_items": items_by_bucket.get(row["bucket"], []),
+        }
+        for row in counts
+    ]
+    return result[:limit]
+
+
+def transaction_rollups(manager, today):
+    """
+    Daily (7 days), weekly (8 weeks) and monthly (12 months) borrow counts
+    with their top-5 items, scoped to `manager`.
+    """
+    rollups = scoped_rollups(manager)
+
+    # Weeks start on Monday; only whole weeks inside the 8-week window count.
+    start_weekly = today - timedelta(weeks=7)
+    start_weekly += timedelta(days=(7 - start_weekly.weekday()) % 7)
+
+    return {
+        "daily_7": _bucket_rollup(
+            rollups.filter(day__lte=today), TruncDay,
+            today - timedelta(days=6), "%Y-%m-%d", "date", 7,
+        ),
+        "weekly_8": _bucket_rollup(
+            rollups, TruncWeek, start_weekly, "%Y-%m-%d", "week_start", 8,
+        ),
+        "monthly_12": _bucket_rollup(
+            rollups, TruncMonth, today - relativedelta(months=11), "%Y-%m", "month", 12,
+        ),
+    }
+
+
+def monthly_status_counts(start, manager=None):
+    """{'YYYY-MM': {'borrowed': n, 'returned': n}} for loans started since `start`."""
+    rows = (
+        scoped_rollups(manager).filter(item__isnull=True, day__gte=start)
+        .annotate(month=TruncMonth("day"))
+        .values("month")
+        .annotate(borrowed=still_borrowed(), returned=Sum("returned"))
+    )
+    return {
+        row["month"].strftime('%Y-%m'): {'borrowed': row["borrowed"], 'returned': row["returned"]}
+        for row in rows
+    }
+
+
+# ----------------------------
+# Inventory summary
+# ----------------------------
+
+def _summary_version_key(manager_id):
+    return f"inventory_summary:v:{manager_id}"
+
+
+def invalidate_inventory_summary(manager_ids):
+    """
+    Drop the cached summary counters of `manager_ids` once the current DB
+    transaction commits (immediately outside of one). Bumping a version
+    instead of deleting keys means a read racing the write can only fill
+    an entry that is never looked up again.
+    """
+    manager_ids = set(manager_ids)
+
+    def bump():
+        for manager_id in manager_ids:
+            key = _summary_version_key(manager_id)
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, 1, None)
+
+    db_transaction.on_commit(bump)
+
+
+def inventory_summary(transactions, today, scope, manager_id):
+    """
+    Returned / overdue / borrowed / due-today counts of `transactions` in one
+    aggregate() query, cached per `scope` until `manager_id`'s data changes
+    or the day rolls over. The TTL bounds staleness with per-process caches.
+    """
+    version = cache.get(_summary_version_key(manager_id), 0)
+    key = f"inventory_summary:{scope}:{version}:{today.isoformat()}"
+    counts = cache.get(key)
+    if counts is None:
+        counts = transactions.aggregate(
+            returned=Count('id', filter=Q(status='returned')),
+            overdue=Count('id', filter=overdue_q(today)),
+            non_overdue_borrowed=Count('id', filter=Q(status='borrowed') & ~Q(return_date__lt=today)),
+            returning_today=Count('id', filter=Q(status='borrowed', return_date=today)),
+        )
+        cache.set(key, counts, getattr(settings, 'INVENTORY_SUMMARY_CACHE_TTL', 60))
+    return counts
+
+
+# ----------------------------
+# Damage risk
+# ----------------------------
+
+DAMAGE_KEYWORDS = ("damaged", "damage", "broken", "crack", "dent", "loose")
+
+
+def with_risk_features(items_qs, today):
+    """
+    Annotate items with total_borrows, recent_borrows (90 days) and
+    overdue_count in a single grouped query over the items through-table.
+    """
+    ninety_days_ago = today - timedelta(days=90)
+    return items_qs.annotate(
+        total_borrows=Count('transactions'),
+        recent_borrows=Count('transactions', filter=Q(transactions__borrow_date__gte=ninety_days_ago)),
+        overdue_count=Count('transactions', filter=Q(transactions__status='overdue')),
+    )
+
+
+def score_risk(item):
+    """Heuristic damage risk for an item annotated by with_risk_features()."""
+    # Use current item condition as a damage signal
+    cond_text = (item.condition or "").lower()
+    damage_flag = any(k in cond_text for k in DAMAGE_KEYWORDS)
+
+    risk = 0.0
+    if item.recent_borrows > 3:  # heavy recent usage
+        risk += 0.30
+    if item.overdue_count > 1:   # mishandling risk
+        risk += 0.20
+    if damage_flag:              # already showing issues
+        risk += 0.40
+    if item.total_borrows > 10:  # wear/tear
+        risk += 0.10
+    risk = min(1.0, risk)
+
+    reason = (
+        f"Total borrows: {item.total_borrows}, "
+        f"Recent(90d): {item.recent_borrows}, "
+        f"Overdue: {item.overdue_count}, "
+        f"Current condition: {item.condition or 'N/A'}"
+    )
+    return risk, reason
+
+
+def mark_predictions_dirty(item_ids):
+    """Flag the stored predictions of `item_ids` for recomputation (one upsert)."""
+    if not item_ids:
+        return
+    PredictiveItemCondition.objects.bulk_create(
+        [PredictiveItemCondition(item_id=item_id, is_dirty=True) for item_id in set(item_ids)],
+        update_conflicts=True,
+        unique_fields=['item'],
+        update_fields=['is_dirty'],
+    )
+
+
+def refresh_predictions(predictions):
+    """
+    Recompute `predictions` (PredictiveItemCondition rows) with one feature
+    query and write them back with one bulk_update.
+    """
+    now = timezone.now()
+    by_item = {p.item_id: p for p in predictions}
+    items = with_risk_features(
+        Item.objects.filter(id__in=by_item).only('id', 'condition'), timezone.localdate()
+    )
+    for item in items:
+        prediction = by_item[item.id]
+        prediction.predicted_risk, prediction.reason = score_risk(item)
+        prediction.last_checked = now
+        prediction.is_dirty = False
+    PredictiveItemCondition.objects.bulk_update(
+        predictions, ['predicted_risk', 'reason', 'last_checked', 'is_dirty']
+    )
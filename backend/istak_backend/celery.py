@@ -2,6 +2,7 @@ from __future__ import absolute_import, unicode_literals
 import os
 from celery import Celery
 from celery.schedules import crontab
+from celery.signals import worker_process_init
 # celery.py
 
 
@@ -13,14 +14,49 @@ app = Celery('istak_backend')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
 app.autodiscover_tasks()
+
+
+@worker_process_init.connect
+def warm_image_session(**kwargs):
+    # One rembg session per worker process, loaded before the first job
+    from istak_backend.imaging import warm_rembg_session
+    warm_rembg_session()
+
 app.conf.beat_schedule = {
-    "notify-due-items-daily": {
-        "task": "istak_backend.tasks.notify_due_items",
-        "schedule": crontab(hour=8, minute=0),  # every day at 8 AM
+    # Reminders are queued per loan with an ETA (reminders.py); these runs
+    # only reconcile what they missed, so they can be infrequent.
+    "plan-due-reminders": {
+        "task": "istak_backend.tasks.plan_due_reminders",
+        "schedule": crontab(hour=0, minute=10),
     },
-    # For testing: runs every 1 minute
-    "test-notify-every-minute": {
+    "notify-due-items": {
         "task": "istak_backend.tasks.notify_due_items",
-        "schedule": crontab(minute="*/1"),
+        "schedule": crontab(hour="8-21", minute=30),
+    },
+    # nightly pass flipping loans that fell due yesterday (and any edited
+    # below the high-water mark); loans written with a past return date are
+    # created or saved as 'overdue' by the views
+    "sweep-overdue-transactions-full": {
+        "task": "istak_backend.tasks.sweep_overdue_transactions",
+        "schedule": crontab(hour=0, minute=5),
+        "kwargs": {"full": True},
+    },
+    # catches rows whose on-commit drain could not be queued, and retries
+    "drain-notification-outbox": {
+        "task": "istak_backend.tasks.drain_notification_outbox",
+        "schedule": crontab(minute="*"),
+    },
+    "prune-notification-outbox": {
+        "task": "istak_backend.tasks.prune_notification_outbox",
+        "schedule": crontab(hour=0, minute=20),
+    },
+    # item images whose background-removal job was lost
+    "requeue-stuck-item-images": {
+        "task": "istak_backend.tasks.requeue_stuck_item_images",
+        "schedule": crontab(minute="*/5"),
+    },
+    "recompute-item-predictions": {
+        "task": "istak_backend.tasks.recompute_item_predictions",
+        "schedule": crontab(minute="*/15"),
     },
 }
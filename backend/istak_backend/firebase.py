@@ -1,8 +1,13 @@
 # firebase.py
 import os
 import json
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
 import firebase_admin
-from firebase_admin import credentials, messaging
+from django.conf import settings
+from firebase_admin import credentials, exceptions, messaging
 
 # 🔹 Load Firebase credentials from environment variable
 firebase_json = os.getenv("FIREBASE_CREDENTIALS")
@@ -23,17 +28,118 @@ if not firebase_admin._apps:
         print(f"❌ Firebase initialization failed: {e}")
 
 def send_push_notification(fcm_token, title, body):
-    try:
-        message = messaging.Message(
-            notification=messaging.Notification(
-                title=title,
-                body=body,
-            ),
-            token=fcm_token,
-        )
-        response = messaging.send(message)
-        print(f"✅ Successfully sent notification: {response}")
-        return response
-    except Exception as e:
-        print(f"❌ Error sending notification: {str(e)}")
-        return None
+    """
+    Queue one push in the notification outbox (in the caller's DB
+    transaction); drain_notification_outbox delivers and retries it.
+    Returns the outbox row, or None when there is no token.
+    """
+    from .outbox import enqueue_pushes  # firebase.py is imported before the app registry is ready
+
+    rows = enqueue_pushes([Push(fcm_token, title, body)])
+    return rows[0] if rows else None
+
+
+# ----------------------------
+# Batched delivery
+# ----------------------------
+
+FCM_BATCH_SIZE = 500  # FCM's limit for one send_each() call
+
+# One push to deliver, and the outcome for its token
+Push = namedtuple("Push", ["token", "title", "body"])
+SendResult = namedtuple("SendResult", ["token", "success", "error", "dead"])
+
+# Errors meaning the token will never work again
+DEAD_TOKEN_ERRORS = (
+    messaging.UnregisteredError,
+    messaging.SenderIdMismatchError,
+)
+
+
+def is_dead_token_error(error):
+    """
+    True when `error` condemns the token itself. INVALID_ARGUMENT also covers
+    malformed payloads (oversize body, bad data keys), so it only counts when
+    FCM names the registration token as the bad argument.
+    """
+    if isinstance(error, DEAD_TOKEN_ERRORS):
+        return True
+    return isinstance(error, exceptions.InvalidArgumentError) and "registration token" in str(error).lower()
+
+
+class FirebaseTransport:
+    """Sends one batch through messaging.send_each (one HTTP call per batch)."""
+
+    def send_batch(self, pushes):
+        response = messaging.send_each([
+            messaging.Message(
+                notification=messaging.Notification(title=push.title, body=push.body),
+                token=push.token,
+            )
+            for push in pushes
+        ])
+        return [
+            SendResult(push.token, r.success, r.exception, is_dead_token_error(r.exception))
+            for push, r in zip(pushes, response.responses)
+        ]
+
+
+class FakeTransport:
+    """
+    Local stand-in for FCM to measure throughput: sleeps `latency` seconds
+    per batch and fails the tokens in `dead_tokens` as unregistered.
+    """
+
+    def __init__(self, latency=0.05, dead_tokens=()):
+        self.latency = latency
+        self.dead_tokens = set(dead_tokens)
+        self.batches = 0
+
+    def send_batch(self, pushes):
+        time.sleep(self.latency)
+        self.batches += 1
+        return [
+            SendResult(push.token, False, "unregistered", True) if push.token in self.dead_tokens
+            else SendResult(push.token, True, None, False)
+            for push in pushes
+        ]
+
+
+def get_transport():
+    """The transport named by settings.FCM_TRANSPORT ("firebase" or "fake")."""
+    if settings.FCM_TRANSPORT == "fake":
+        return FakeTransport()
+    return FirebaseTransport()
+
+
+def send_pushes(pushes, transport=None, batch_size=FCM_BATCH_SIZE, concurrency=None):
+    """
+    Deliver `pushes` in send_each batches of up to `batch_size`, at most
+    `concurrency` (settings.FCM_MAX_CONCURRENCY) batches in flight, and
+    clear tokens FCM reports as dead from CustomUser.fcm_token.
+    Returns the SendResults in input order.
+    """
+    from .models import CustomUser  # firebase.py is imported before the app registry is ready
+
+    pushes = [push for push in pushes if push.token]
+    if not pushes:
+        return []
+    transport = transport or get_transport()
+    concurrency = concurrency or settings.FCM_MAX_CONCURRENCY
+    batches = [pushes[i:i + batch_size] for i in range(0, len(pushes), batch_size)]
+
+    def send(batch):
+        try:
+            return transport.send_batch(batch)
+        except Exception as e:  # the whole call failed (network, auth)
+            print(f"❌ FCM batch of {len(batch)} failed: {e}")
+            return [SendResult(push.token, False, e, False) for push in batch]
+
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(batches))) as pool:
+        results = [result for batch_results in pool.map(send, batches) for result in batch_results]
+
+    dead = {result.token for result in results if result.dead}
+    if dead:
+        cleared = CustomUser.objects.filter(fcm_token__in=dead).update(fcm_token=None)
+        print(f"🧹 {len(dead)} dead FCM token(s), cleared from {cleared} user(s)")
+    return results
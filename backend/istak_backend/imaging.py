@@ -0,0 +1,419 @@
+# imaging.py
+"""
+Item image pipeline. Uploads are stored as-is with image_status='processing'
+and background removal runs off the request path: on Celery when a broker
+is configured, otherwise on a small bounded in-process thread pool.
+Jobs that never finish (recycled worker, crash) are requeued by
+requeue_stuck_item_images, run periodically by Celery beat or, for the
+in-process pool, by a sweeper thread in each gunicorn worker.
+Each process keeps one rembg/ONNX session per model, created (and warmed)
+once and shared by every job. All upload paths decode through
+prepare_image(), which bounds the decoded size before any pixel work.
+List endpoints serve WebP renditions (thumb/medium/full) stored under the
+content hash of the source, so identical images share their files.
+Borrower photos are stamped by watermark_photo(), which caches its fonts.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import lru_cache
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, transaction as db_transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from PIL import Image, ImageDraw, ImageFont, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+
+# ----------------------------
+# Preprocessing
+# ----------------------------
+
+class ImageRejected(ValueError):
+    """The upload is not a decodable image, or is too large to decode safely."""
+
+
+def prepare_image(source, mode="RGB", max_dimension=None):
+    """
+    Decode an upload for processing. The pixel count is checked from the
+    header before decoding (decompression-bomb guard), JPEGs are decoded in
+    draft mode at the smallest 1/2-1/8 scale that still covers
+    `max_dimension`, EXIF orientation is applied and the result is
+    downscaled to fit `max_dimension` (settings.IMAGE_MAX_DIMENSION).
+    """
+    max_dimension = max_dimension or settings.IMAGE_MAX_DIMENSION
+    try:
+        image = Image.open(source)  # header only
+    except (UnidentifiedImageError, Image.DecompressionBombError) as e:
+        raise ImageRejected(f"Unsupported image: {e}")
+
+    if image.width * image.height > settings.IMAGE_MAX_PIXELS:
+        raise ImageRejected(f"Image too large ({image.width}x{image.height})")
+
+    try:
+        if image.format == "JPEG":
+            image.draft(None, (max_dimension, max_dimension))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+        if mode and image.mode != mode:
+            image = image.convert(mode)
+    except OSError as e:  # truncated or corrupt data
+        raise ImageRejected(f"Could not decode image: {e}")
+    return image
+
+
+# ----------------------------
+# Watermarks
+# ----------------------------
+
+WATERMARK_EXTENSIONS = {"JPEG": "jpg", "WEBP": "webp", "PNG": "png"}
+
+
+@lru_cache(maxsize=8)
+def watermark_font(size):
+    """The overlay font at `size` px, loaded from disk once per process."""
+    try:
+        return ImageFont.truetype(os.path.join(settings.BASE_DIR, 'fonts', 'arial.ttf'), size)
+    except IOError:
+        return ImageFont.load_default(size=size)
+
+
+def watermark_photo(image, name, school_id, label, filename_prefix):
+    """
+    Stamp name, school ID and "<label>: <timestamp>" on a prepare_image()d
+    photo and encode it as settings.WATERMARK_FORMAT / WATERMARK_QUALITY.
+    Returns a ContentFile named <filename_prefix>_<school_id>_<timestamp>.<ext>.
+    """
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    text = f"Name: {name}\nSchool ID: {school_id}\n{label}: {timestamp}"
+
+    ImageDraw.Draw(image).multiline_text(
+        (10, 10),
+        text,
+        font=watermark_font(settings.WATERMARK_FONT_SIZE),
+        fill=(255, 255, 255, 255),
+        stroke_width=2,
+        stroke_fill=(0, 0, 0, 255)
+    )
+
+    image_format = settings.WATERMARK_FORMAT.upper()
+    options = {} if image_format == "PNG" else {"quality": settings.WATERMARK_QUALITY}
+    buffer = BytesIO()
+    image.save(buffer, format=image_format, **options)
+
+    timestamp_clean = timestamp.replace(":", "-").replace(" ", "_")
+    extension = WATERMARK_EXTENSIONS.get(image_format, image_format.lower())
+    return ContentFile(buffer.getvalue(), name=f"{filename_prefix}_{school_id}_{timestamp_clean}.{extension}")
+
+
+# ----------------------------
+# rembg sessions
+# ----------------------------
+
+_sessions = {}
+_session_lock = threading.Lock()
+
+
+def _new_rembg_session(model_name):
+    # rembg.new_session() only reads the thread count from OMP_NUM_THREADS,
+    # so build the session options here to take it from settings instead.
+    import onnxruntime as ort
+    from rembg.sessions import sessions_class
+
+    sess_opts = ort.SessionOptions()
+    if settings.REMBG_THREADS:
+        sess_opts.intra_op_num_threads = settings.REMBG_THREADS
+        sess_opts.inter_op_num_threads = 1
+    for session_class in sessions_class:
+        if session_class.name() == model_name:
+            return session_class(model_name, sess_opts)
+    raise ValueError(f"Unknown rembg model '{model_name}'")
+
+
+def get_rembg_session(model_name=None):
+    """The process-wide rembg session for `model_name` (settings.REMBG_MODEL by default)."""
+    model_name = model_name or settings.REMBG_MODEL
+    session = _sessions.get(model_name)
+    if session is None:
+        with _session_lock:
+            session = _sessions.get(model_name)
+            if session is None:
+                session = _sessions[model_name] = _new_rembg_session(model_name)
+    return session
+
+
+def warm_rembg_session(background=True):
+    """
+    Load the model and run one tiny inference so the first real upload does
+    not pay for it. Called at worker start (gunicorn post_fork, Celery
+    worker_process_init); runs in a daemon thread unless `background` is False.
+    """
+    if not settings.REMBG_PREWARM:
+        return
+
+    def warm():
+        from rembg import remove
+        try:
+            remove(Image.new("RGBA", (64, 64)), session=get_rembg_session())
+            logger.info(f"rembg session '{settings.REMBG_MODEL}' warmed in pid {os.getpid()}")
+        except Exception as e:
+            logger.warning(f"Could not warm rembg session: {e}")
+
+    if background:
+        threading.Thread(target=warm, name="rembg-warmup", daemon=True).start()
+    else:
+        warm()
+
+
+# ----------------------------
+# Background removal
+# ----------------------------
+
+def remove_background(image_file):
+    """Cut the subject out of `image_file` and return it as PNG bytes."""
+    from rembg import remove  # heavy import (onnxruntime); only the job needs it
+
+    input_img = prepare_image(image_file, mode="RGBA")
+    output_img = remove(input_img, session=get_rembg_session())
+    buffer = BytesIO()
+    output_img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def process_item_image(item_id):
+    """
+    Replace the stored upload of `item_id` with its background-removed PNG.
+    The swap only happens if the item still points at the file that was
+    processed, so a newer upload made meanwhile wins.
+    """
+    from .models import Item
+
+    item = Item.objects.filter(pk=item_id).only('id', 'image').first()
+    if not item or not item.image:
+        return
+    original = item.image.name
+    storage = item.image.storage
+
+    try:
+        with item.image.open('rb') as image_file:
+            data = remove_background(image_file)
+    except Exception as e:
+        logger.error(f"Error removing background for item {item_id}: {str(e)}")
+        Item.objects.filter(pk=item_id, image=original).update(image_status='failed')
+        return
+
+    name = f"{os.path.splitext(os.path.basename(original))[0]}.png"
+    stored = storage.save(item.image.field.generate_filename(item, name), ContentFile(data))
+    renditions = build_renditions(data, storage, source=stored)
+    updated = Item.objects.filter(pk=item_id, image=original).update(
+        image=stored, image_status='ready', image_renditions=renditions,
+    )
+    if updated:
+        storage.delete(original)
+        logger.info(f"Background removed for item {item_id}")
+    else:
+        storage.delete(stored)
+
+
+# ----------------------------
+# Renditions
+# ----------------------------
+
+def build_renditions(data, storage, source):
+    """
+    Write a WebP of `data` (image bytes) for every settings.IMAGE_RENDITIONS
+    size under renditions/<sha256 of data>/ and return the rendition map
+    {"source": source, name: path, ...}. Files that already exist for the
+    same content are reused instead of re-encoded.
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    renditions = {"source": source}
+    image = None
+    # Largest first, so every smaller size is a cheap downscale of the last one
+    for name, size in sorted(settings.IMAGE_RENDITIONS.items(), key=lambda r: -r[1]):
+        path = f"renditions/{digest[:2]}/{digest}/{name}.webp"
+        if not storage.exists(path):
+            if image is None:
+                image = prepare_image(BytesIO(data), mode=None, max_dimension=size)
+                if image.mode not in ("RGB", "RGBA"):
+                    has_alpha = "A" in image.getbands() or "transparency" in image.info
+                    image = image.convert("RGBA" if has_alpha else "RGB")
+            else:
+                image = image.copy()
+            image.thumbnail((size, size), Image.Resampling.LANCZOS)
+            buffer = BytesIO()
+            image.save(buffer, format="WEBP", quality=settings.IMAGE_WEBP_QUALITY, method=4)
+            path = storage.save(path, ContentFile(buffer.getvalue()))
+        renditions[name] = path
+    return renditions
+
+
+def generate_renditions(model_label, pk, field_name="image"):
+    """Build and store `<field_name>_renditions` for one row (unless its image changed meanwhile)."""
+    from django.apps import apps
+
+    model = apps.get_model(model_label)
+    obj = model.objects.filter(pk=pk).only("pk", field_name).first()
+    field_file = getattr(obj, field_name, None)
+    if not field_file:
+        return
+    with field_file.open("rb") as f:
+        data = f.read()
+    try:
+        renditions = build_renditions(data, field_file.storage, source=field_file.name)
+    except ImageRejected as e:
+        logger.warning(f"No renditions for {model_label} {pk}: {e}")
+        return
+    model.objects.filter(pk=pk, **{field_name: field_file.name}).update(
+        **{f"{field_name}_renditions": renditions}
+    )
+
+
+def rendition_urls(request, field_file, renditions):
+    """
+    Absolute URLs for every rendition of `field_file`. Until the renditions
+    match the current file (still processing, or never built) every size
+    falls back to the original image.
+    """
+    if not field_file:
+        return None
+    build = request.build_absolute_uri if request else (lambda url: url)
+    storage = field_file.storage
+    if not renditions or renditions.get("source") != field_file.name:
+        url = build(field_file.url)
+        return {name: url for name in settings.IMAGE_RENDITIONS}
+    return {name: build(storage.url(renditions[name])) for name in settings.IMAGE_RENDITIONS}
+
+
+# ----------------------------
+# Dispatch
+# ----------------------------
+
+_pool = None
+_pool_slots = None
+_pool_lock = threading.Lock()
+
+
+def _fallback_pool():
+    global _pool, _pool_slots
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                max_workers=settings.IMAGE_PROCESSING_THREADS,
+                thread_name_prefix="image-job",
+            )
+            _pool_slots = threading.BoundedSemaphore(settings.IMAGE_PROCESSING_MAX_PENDING)
+    return _pool, _pool_slots
+
+
+def _run_in_pool(job, args, slots):
+    try:
+        job(*args)
+    except Exception:
+        logger.exception(f"Image job {job.__name__}{args} crashed")
+    finally:
+        connection.close()  # this thread's own DB connection
+        slots.release()
+
+
+def _dispatch(task_name, job, args, on_overflow=None):
+    """Run `job(*args)` as Celery task `task_name`, or on the local pool."""
+    if settings.IMAGE_PROCESSING_BACKEND == "celery":
+        from . import tasks
+        try:
+            getattr(tasks, task_name).delay(*args)
+            return
+        except Exception as e:
+            logger.warning(f"Could not queue {task_name}{args} ({e}); using local pool")
+
+    pool, slots = _fallback_pool()
+    if not slots.acquire(blocking=False):
+        # Never block the request on a full backlog
+        logger.warning(f"Image backlog full, dropping {task_name}{args}")
+        if on_overflow:
+            on_overflow()
+        return
+    pool.submit(_run_in_pool, job, args, slots)
+
+
+def _mark_item_image_failed(item_id):
+    from .models import Item
+    Item.objects.filter(pk=item_id).update(image_status='failed')
+
+
+def _queue_item_image(item_id):
+    db_transaction.on_commit(lambda: _dispatch(
+        "remove_item_background", process_item_image, (item_id,),
+        on_overflow=lambda: _mark_item_image_failed(item_id),
+    ))
+
+
+def schedule_item_image(item_id):
+    """Queue background removal for `item_id` once the current DB transaction commits."""
+    from .models import Item
+    Item.objects.filter(pk=item_id).update(image_queued_at=timezone.now(), image_attempts=1)
+    _queue_item_image(item_id)
+
+
+def requeue_stuck_item_images(batch_size=100):
+    """
+    Requeue items left 'processing' for longer than IMAGE_PROCESSING_TIMEOUT,
+    whose job was lost (e.g. its gunicorn worker was recycled or the process
+    crashed). Items that already had IMAGE_PROCESSING_MAX_ATTEMPTS jobs are
+    marked 'failed' instead. A job that is merely slow may run twice; the
+    swap in process_item_image keeps that harmless. Returns (requeued, failed).
+    """
+    from .models import Item
+
+    now = timezone.now()
+    stuck = Item.objects.filter(image_status='processing').filter(
+        Q(image_queued_at__lt=now - timedelta(seconds=settings.IMAGE_PROCESSING_TIMEOUT))
+        | Q(image_queued_at__isnull=True)
+    )
+    with db_transaction.atomic():
+        rows = list(
+            stuck.select_for_update(skip_locked=True)
+            .order_by('image_queued_at')
+            .values_list('id', 'image_attempts')[:batch_size]
+        )
+        retry = [pk for pk, attempts in rows if attempts < settings.IMAGE_PROCESSING_MAX_ATTEMPTS]
+        failed = Item.objects.filter(pk__in=[pk for pk, _ in rows if pk not in retry]).update(image_status='failed')
+        Item.objects.filter(pk__in=retry).update(image_queued_at=now, image_attempts=F('image_attempts') + 1)
+        for item_id in retry:
+            _queue_item_image(item_id)
+    if rows:
+        logger.warning(f"Stuck item images: requeued={len(retry)} failed={failed}")
+    return len(retry), failed
+
+
+def start_stuck_image_sweeper():
+    """
+    Run requeue_stuck_item_images every IMAGE_PROCESSING_SWEEP_INTERVAL in a
+    daemon thread. For the "thread" backend, where there is no Celery beat;
+    called from gunicorn post_fork.
+    """
+    def sweep():
+        while True:
+            time.sleep(settings.IMAGE_PROCESSING_SWEEP_INTERVAL)
+            try:
+                requeue_stuck_item_images()
+            except Exception:
+                logger.exception("Stuck item image sweep failed")
+            finally:
+                connection.close()
+
+    threading.Thread(target=sweep, name="image-sweeper", daemon=True).start()
+
+
+def schedule_renditions(instance, field_name="image"):
+    """Queue rendition building for `instance.<field_name>` once the current DB transaction commits."""
+    args = (instance._meta.label, instance.pk, field_name)
+    db_transaction.on_commit(lambda: _dispatch("build_image_renditions", generate_renditions, args))
@@ -0,0 +1,48 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from istak_backend.firebase import FakeTransport, Push, send_pushes
+
+
+class Command(BaseCommand):
+    help = "Compare push throughput (messages/s) of per-message and batched delivery against a fake FCM."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=2000)
+        parser.add_argument("--latency", type=float, default=0.05, help="Seconds per fake FCM round trip.")
+        parser.add_argument("--dead", type=int, default=50, help="How many tokens the fake reports as unregistered.")
+        parser.add_argument("--concurrency", type=int, help="Override settings.FCM_MAX_CONCURRENCY.")
+        parser.add_argument(
+            "--skip-serial",
+            action="store_true",
+            help="Skip the one-call-per-message baseline (slow for large --messages).",
+        )
+
+    def handle(self, *args, **options):
+        # bench-* tokens never match a real CustomUser, so dead-token cleanup is a no-op update
+        pushes = [Push(f"bench-{i}", "Bench", f"Message {i}") for i in range(options["messages"])]
+        dead = {push.token for push in pushes[:options["dead"]]}
+        concurrency = options["concurrency"] or settings.FCM_MAX_CONCURRENCY
+
+        self.stdout.write(f"messages={len(pushes)} latency={options['latency'] * 1000:.0f}ms "
+                          f"dead={len(dead)} concurrency={concurrency}")
+
+        if not options["skip_serial"]:
+            transport = FakeTransport(options["latency"], dead)
+            start = time.perf_counter()
+            for push in pushes:
+                transport.send_batch([push])
+            self._report("per-message", len(pushes), time.perf_counter() - start, transport.batches)
+
+        transport = FakeTransport(options["latency"], dead)
+        start = time.perf_counter()
+        results = send_pushes(pushes, transport=transport, concurrency=concurrency)
+        self._report("batched", len(pushes), time.perf_counter() - start, transport.batches)
+        self.stdout.write(f"sent={sum(r.success for r in results)} dead={sum(r.dead for r in results)}")
+
+    def _report(self, label, count, elapsed, calls):
+        self.stdout.write(self.style.SUCCESS(
+            f"{label}: {count / elapsed:.0f} messages/s ({elapsed:.2f}s, {calls} FCM calls)"
+        ))
@@ -0,0 +1,81 @@
+import resource
+import statistics
+import time
+from io import BytesIO
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+def _rss_mb():
+    """Current resident set size in MB (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Command(BaseCommand):
+    help = "Measure rembg background-removal latency and memory with the shared session."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--image", default=str(settings.BASE_DIR / "lapy.jpg"))
+        parser.add_argument("--runs", type=int, default=5)
+        parser.add_argument("--model", help="Override settings.REMBG_MODEL.")
+        parser.add_argument("--threads", type=int, help="Override settings.REMBG_THREADS.")
+        parser.add_argument(
+            "--per-call",
+            action="store_true",
+            help="Also time the old path (a new session for every call).",
+        )
+
+    def handle(self, *args, **options):
+        if options["model"]:
+            settings.REMBG_MODEL = options["model"]
+        if options["threads"] is not None:
+            settings.REMBG_THREADS = options["threads"]
+
+        try:
+            with open(options["image"], "rb") as f:
+                data = f.read()
+        except OSError as e:
+            raise CommandError(f"Cannot read {options['image']}: {e}")
+
+        from rembg import remove
+        from istak_backend.imaging import get_rembg_session, remove_background
+
+        self.stdout.write(f"model={settings.REMBG_MODEL} threads={settings.REMBG_THREADS or 'default'} "
+                          f"image={options['image']} rss_start={_rss_mb():.0f}MB")
+
+        start = time.perf_counter()
+        get_rembg_session()
+        self.stdout.write(f"session load: {time.perf_counter() - start:.2f}s rss={_rss_mb():.0f}MB")
+
+        timings = []
+        for _ in range(options["runs"]):
+            start = time.perf_counter()
+            remove_background(BytesIO(data))
+            timings.append(time.perf_counter() - start)
+        self._report("shared session", timings)
+
+        if options["per_call"]:
+            from PIL import Image
+            timings = []
+            for _ in range(options["runs"]):
+                start = time.perf_counter()
+                remove(Image.open(BytesIO(data)).convert("RGBA"))
+                timings.append(time.perf_counter() - start)
+            self._report("session per call", timings)
+
+    def _report(self, label, timings):
+        ordered = sorted(timings)
+        p95 = ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+        self.stdout.write(self.style.SUCCESS(
+            f"{label}: mean={statistics.mean(timings) * 1000:.0f}ms "
+            f"p50={statistics.median(timings) * 1000:.0f}ms p95={p95 * 1000:.0f}ms "
+            f"rss={_rss_mb():.0f}MB peak={resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f}MB"
+        ))
@@ -0,0 +1,56 @@
+import os
+import time
+from io import BytesIO
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image, ImageDraw, ImageFont
+
+from istak_backend.imaging import prepare_image, watermark_photo
+
+
+def _legacy_watermark(data):
+    """The per-request path this replaced: full-size decode, font load, lossless PNG."""
+    image = Image.open(BytesIO(data)).convert('RGB')
+    draw = ImageDraw.Draw(image)
+    try:
+        font = ImageFont.truetype(os.path.join(settings.BASE_DIR, 'fonts', 'arial.ttf'), 24)
+    except IOError:
+        font = ImageFont.load_default(size=24)
+    draw.multiline_text((10, 10), "Name: Bench\nSchool ID: 0000000\nReturned: now", font=font,
+                        fill=(255, 255, 255, 255), stroke_width=2, stroke_fill=(0, 0, 0, 255))
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _watermark(data):
+    return watermark_photo(prepare_image(BytesIO(data)), "Bench", "0000000", "Returned", "bench").read()
+
+
+class Command(BaseCommand):
+    help = "Compare watermarking throughput (images/s) of the legacy and shared renderers."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--image", default=str(settings.BASE_DIR / "lapy.jpg"))
+        parser.add_argument("--runs", type=int, default=20)
+
+    def handle(self, *args, **options):
+        try:
+            with open(options["image"], "rb") as f:
+                data = f.read()
+        except OSError as e:
+            raise CommandError(f"Cannot read {options['image']}: {e}")
+
+        self.stdout.write(f"image={options['image']} ({len(data) // 1024}KB) runs={options['runs']} "
+                          f"format={settings.WATERMARK_FORMAT} quality={settings.WATERMARK_QUALITY}")
+        for label, render in (("legacy", _legacy_watermark), ("shared", _watermark)):
+            render(data)  # warm-up (first font load, codec init)
+            start = time.perf_counter()
+            for _ in range(options["runs"]):
+                size = len(render(data))
+            elapsed = time.perf_counter() - start
+            self.stdout.write(self.style.SUCCESS(
+                f"{label}: {options['runs'] / elapsed:.1f} images/s "
+                f"({elapsed / options['runs'] * 1000:.1f}ms each, {size // 1024}KB output)"
+            ))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from istak_backend.imaging import generate_renditions
+from istak_backend.models import Borrower, Item
+
+
+class Command(BaseCommand):
+    help = "Build missing or stale WebP renditions for item and borrower images."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Rebuild renditions even when they match the current image.",
+        )
+
+    def handle(self, *args, **options):
+        built = 0
+        for model in (Item, Borrower):
+            rows = model.objects.exclude(image="").exclude(image__isnull=True).only("pk", "image", "image_renditions")
+            for obj in rows.iterator():
+                if not options["force"] and obj.image_renditions.get("source") == obj.image.name:
+                    continue
+                try:
+                    generate_renditions(model._meta.label, obj.pk)
+                    built += 1
+                except OSError as e:  # missing file in storage
+                    self.stderr.write(f"{model.__name__} {obj.pk}: {e}")
+
+        self.stdout.write(self.style.SUCCESS(f"Built renditions for {built} images"))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction as db_transaction
+
+from istak_backend.analytics import rebuild_rollups
+from istak_backend.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily transaction rollups from transaction history."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--manager",
+            help="Only rebuild rollups for this manager username.",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        manager = None
+        if options["manager"]:
+            manager = CustomUser.objects.filter(
+                username=options["manager"], role="user_web"
+            ).first()
+            if manager is None:
+                raise CommandError(f"Manager {options['manager']!r} not found")
+
+        with db_transaction.atomic():
+            written = rebuild_rollups(manager=manager, batch_size=options["batch_size"])
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {written} rollup rows"))
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.5 on 2026-10-17 10:04
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def backfill_rollups(apps, schema_editor):
+    """
+    Fill the new table from existing transactions so the charts have history
+    on deploy: per manager and borrow day, one total row and one row per item.
+    Kept self-contained (historical models only) rather than calling
+    analytics.rebuild_rollups, so later changes there don't alter it.
+    """
+    Transaction = apps.get_model('istak_backend', 'Transaction')
+    DailyTransactionRollup = apps.get_model('istak_backend', 'DailyTransactionRollup')
+
+    transactions = Transaction.objects.filter(manager__isnull=False)
+    rows = [
+        DailyTransactionRollup(manager_id=row['manager_id'], day=row['borrow_date'],
+                               borrowed=row['borrowed'], returned=row['returned'], overdue=row['overdue'])
+        for row in transactions.values('manager_id', 'borrow_date').annotate(
+            borrowed=Count('id'),
+            returned=Count('id', filter=Q(status='returned')),
+            overdue=Count('id', filter=Q(status='overdue')),
+        )
+    ]
+    rows.extend(
+        DailyTransactionRollup(manager_id=row['transaction__manager_id'], day=row['transaction__borrow_date'],
+                               item_id=row['item_id'], borrowed=row['borrowed'], returned=row['returned'],
+                               overdue=row['overdue'])
+        for row in Transaction.items.through.objects.filter(transaction__in=transactions)
+        .values('transaction__manager_id', 'transaction__borrow_date', 'item_id')
+        .annotate(
+            borrowed=Count('id'),
+            returned=Count('id', filter=Q(transaction__status='returned')),
+            overdue=Count('id', filter=Q(transaction__status='overdue')),
+        )
+    )
+    DailyTransactionRollup.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('istak_backend', '0008_borrower_return_image'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyTransactionRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('borrowed', models.IntegerField(default=0)),
+                ('returned', models.IntegerField(default=0)),
+                ('overdue', models.IntegerField(default=0)),
+                ('item', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to='istak_backend.item')),
+                ('manager', models.ForeignKey(limit_choices_to={'role': 'user_web'}, on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('manager', 'day', 'item'), name='unique_rollup_manager_day_item'), models.UniqueConstraint(condition=models.Q(('item__isnull', True)), fields=('manager', 'day'), name='unique_rollup_manager_day_total')],
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
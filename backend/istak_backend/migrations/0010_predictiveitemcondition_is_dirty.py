@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 10:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('istak_backend', '0009_dailytransactionrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='predictiveitemcondition',
+            name='is_dirty',
+            field=models.BooleanField(db_index=True, default=True),
+        ),
+    ]
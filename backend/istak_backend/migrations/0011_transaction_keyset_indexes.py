@@ -0,0 +1,25 @@
+# Generated by Django 5.2.5 on 2026-10-17 10:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('istak_backend', '0010_predictiveitemcondition_is_dirty'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['manager', 'borrow_date', 'id'], name='istak_backe_manager_bfc960_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['mobile_user', 'borrow_date', 'id'], name='istak_backe_mobile__7c8ba7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['borrower', 'borrow_date', 'id'], name='istak_backe_borrowe_1f8ca8_idx'),
+        ),
+    ]
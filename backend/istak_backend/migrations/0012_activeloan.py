@@ -0,0 +1,41 @@
+# Generated by Django 5.2.5 on 2026-10-17 10:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_active_loans(apps, schema_editor):
+    """Open a loan for every item on a borrowed/overdue transaction (latest wins)."""
+    Transaction = apps.get_model('istak_backend', 'Transaction')
+    ActiveLoan = apps.get_model('istak_backend', 'ActiveLoan')
+    Through = Transaction.items.through
+
+    open_rows = (
+        Through.objects.filter(transaction__status__in=['borrowed', 'overdue'])
+        .order_by('transaction__borrow_date', 'transaction_id')
+        .values_list('item_id', 'transaction_id', 'transaction__manager_id')
+    )
+    loans = {}
+    for item_id, transaction_id, manager_id in open_rows.iterator():
+        loans[item_id] = ActiveLoan(item_id=item_id, transaction_id=transaction_id, manager_id=manager_id)
+    ActiveLoan.objects.bulk_create(loans.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('istak_backend', '0011_transaction_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActiveLoan',
+            fields=[
+                ('item', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='active_loan', serialize=False, to='istak_backend.item')),
+                ('manager', models.ForeignKey(blank=True, limit_choices_to={'role': 'user_web'}, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='active_loans', to=settings.AUTH_USER_MODEL)),
+                ('transaction', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='active_loans', to='istak_backend.transaction')),
+            ],
+        ),
+        migrations.RunPython(backfill_active_loans, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 10:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('istak_backend', '0013_overdue_sweep'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='image_status',
+            field=models.CharField(choices=[('ready', 'Ready'), ('processing', 'Processing'), ('failed', 'Failed')], default='ready', max_length=20),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-17 10:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('istak_backend', '0014_item_image_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='borrower',
+            name='image_renditions',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='image_renditions',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
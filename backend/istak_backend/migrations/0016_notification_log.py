@@ -0,0 +1,27 @@
+# Generated by Django 5.2.5 on 2026-10-17 10:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('istak_backend', '0015_image_renditions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('due', 'Due Today'), ('overdue', 'Overdue')], max_length=10)),
+                ('day', models.DateField()),
+                ('sent_at', models.DateTimeField(auto_now_add=True)),
+                ('transaction', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to='istak_backend.transaction')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('transaction', 'kind', 'day'), name='unique_notification_transaction_kind_day')],
+            },
+        ),
+    ]
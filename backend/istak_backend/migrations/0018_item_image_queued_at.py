@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-17 10:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('istak_backend', '0017_notification_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='image_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='image_queued_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
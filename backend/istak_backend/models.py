@@ -37,6 +37,11 @@ def generate_12_digit_id():
     return str(random.randint(10**11, (10**12)-1))  # ensures 12 digits
 
 class Item(models.Model):
+    IMAGE_STATUS_CHOICES = [
+        ('ready', 'Ready'),
+        ('processing', 'Processing'),
+        ('failed', 'Failed'),
+    ]
     id = models.CharField(
         primary_key=True,
         max_length=12,
@@ -65,6 +70,15 @@ class Item(models.Model):
         db_index=True
     )
     image = models.ImageField(upload_to='item_images/', null=True, blank=True)
+    # Uploads are stored as-is and marked 'processing' until the background
+    # removal job (imaging.schedule_item_image) swaps in the cut-out PNG.
+    image_status = models.CharField(max_length=20, choices=IMAGE_STATUS_CHOICES, default='ready')
+    # When the current removal job was queued and how many times it has been;
+    # imaging.requeue_stuck_item_images retries jobs that never finished.
+    image_queued_at = models.DateTimeField(null=True, blank=True)
+    image_attempts = models.PositiveSmallIntegerField(default=0)
+    # {"source": image name, "thumb"/"medium"/"full": storage path} (imaging.build_renditions)
+    image_renditions = models.JSONField(default=dict, blank=True)
 
     class Meta:
         unique_together = ('item_name', 'manager')
@@ -81,6 +95,7 @@ class Borrower(models.Model):
     school_id = models.CharField(max_length=10, unique=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
     image = models.ImageField(upload_to='borrower_images/', null=True, blank=True)
+    image_renditions = models.JSONField(default=dict, blank=True)
     return_image = models.ImageField(upload_to='borrower_return_images/', null=True, blank=True)
 
     def __str__(self):
@@ -119,13 +134,24 @@ class Transaction(models.Model):
     class Meta:
         indexes = [
             models.Index(fields=['status', 'manager']),
-            models.Index(fields=['return_date'])
+            models.Index(fields=['return_date']),
+            # keyset pagination order: (borrow_date, id) within a scope
+            models.Index(fields=['manager', 'borrow_date', 'id']),
+            models.Index(fields=['mobile_user', 'borrow_date', 'id']),
+            models.Index(fields=['borrower', 'borrow_date', 'id']),
+            # overdue sweep walks borrowed loans in return_date order
+            models.Index(fields=['status', 'return_date', 'id']),
         ]
 
     def clean(self):
         if self.return_date and self.return_date < self.borrow_date:
             raise ValidationError("Return date cannot be before borrow date.")
 
+    @staticmethod
+    def open_status(return_date):
+        """Status of a loan that is still out: 'overdue' once return_date has passed."""
+        return 'overdue' if return_date and return_date < localdate() else 'borrowed'
+
     def __str__(self):
         borrower_name = self.borrower.name if self.borrower else "Unknown Borrower"
         return f"Transaction for {borrower_name} on {self.borrow_date}"
@@ -174,44 +200,191 @@ class StudentOrgModerator(CustomUser):
         
         
 from django.utils import timezone
-from datetime import timedelta
 
 class PredictiveItemCondition(models.Model):
     item = models.OneToOneField(Item, on_delete=models.CASCADE, related_name='prediction')
     predicted_risk = models.FloatField(default=0.0)
     reason = models.TextField(blank=True, null=True)
     last_checked = models.DateTimeField(auto_now=True)
+    # Set when the item is checked out or returned; cleared by the recompute task
+    is_dirty = models.BooleanField(default=True, db_index=True)
 
     def update_prediction(self):
         """
         Rule-based predictive model for future damage risk.
         """
-        from .models import Transaction  # avoid circular import
-        now = timezone.now().date()
-        transactions = Transaction.objects.filter(items=self.item)
-
-        total_borrows = transactions.count()
-        recent_borrows = transactions.filter(borrow_date__gte=now - timedelta(days=90)).count()
-        overdue_count = transactions.filter(status='overdue').count()
-        damaged_returns = transactions.filter(items__condition__icontains='damaged').count()
-
-        # Weighted risk computation (simple heuristic)
-        risk = 0.0
-        if recent_borrows > 3:
-            risk += 0.3
-        if overdue_count > 1:
-            risk += 0.2
-        if damaged_returns > 0:
-            risk += 0.4
-        if total_borrows > 10:
-            risk += 0.1
-
-        self.predicted_risk = min(risk, 1.0)
-        self.reason = (
-            f"Total borrows: {total_borrows}, Recent borrows: {recent_borrows}, "
-            f"Overdue: {overdue_count}, Damaged returns: {damaged_returns}"
-        )
-        self.save()
+        from .analytics import refresh_predictions  # avoid circular import
+        if self.pk is None:
+            self.save()
+        refresh_predictions([self])
 
     def __str__(self):
         return f"{self.item.item_name} - Risk: {self.predicted_risk:.2f}"
+
+class DailyTransactionRollup(models.Model):
+    """
+    Per-manager, per-day borrow counters that feed the dashboard charts.
+    Rows are keyed by the loan's borrow day: `borrowed` counts loans started
+    that day, `returned`/`overdue` how many of those are currently in that
+    status. The row with item=None holds per-transaction totals; item rows
+    count how often each item was part of those loans.
+    """
+    manager = models.ForeignKey(
+        CustomUser,
+        limit_choices_to={'role': 'user_web'},
+        on_delete=models.CASCADE,
+        related_name='daily_rollups'
+    )
+    day = models.DateField()
+    item = models.ForeignKey(
+        Item,
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        related_name='daily_rollups'
+    )
+    borrowed = models.IntegerField(default=0)
+    returned = models.IntegerField(default=0)
+    overdue = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['manager', 'day', 'item'],
+                name='unique_rollup_manager_day_item',
+            ),
+            models.UniqueConstraint(
+                fields=['manager', 'day'],
+                condition=models.Q(item__isnull=True),
+                name='unique_rollup_manager_day_total',
+            ),
+        ]
+
+    def __str__(self):
+        item_name = self.item.item_name if self.item else "All items"
+        return f"{self.day} - {item_name}: {self.borrowed} borrowed"
+
+
+class ActiveLoan(models.Model):
+    """
+    One row per item that is currently lent out (borrowed or overdue).
+    The item is the primary key, so an item can never be on two open loans
+    and availability checks are primary-key lookups. Rows are created on
+    checkout and deleted on return.
+    """
+    item = models.OneToOneField(
+        Item,
+        primary_key=True,
+        on_delete=models.CASCADE,
+        related_name='active_loan'
+    )
+    transaction = models.ForeignKey(
+        Transaction,
+        on_delete=models.CASCADE,
+        related_name='active_loans'
+    )
+    manager = models.ForeignKey(
+        CustomUser,
+        limit_choices_to={'role': 'user_web'},
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        related_name='active_loans',
+        db_index=True
+    )
+
+    @classmethod
+    def open_for(cls, transaction, item_ids):
+        """Mark `item_ids` as lent out on `transaction` (IntegrityError if any already is)."""
+        return cls.objects.bulk_create([
+            cls(item_id=item_id, transaction=transaction, manager_id=transaction.manager_id)
+            for item_id in item_ids
+        ])
+
+    @classmethod
+    def close_for(cls, transactions):
+        """Release every item held by `transactions` (an instance or queryset)."""
+        if isinstance(transactions, Transaction):
+            return cls.objects.filter(transaction=transactions).delete()
+        return cls.objects.filter(transaction__in=transactions).delete()
+
+    def __str__(self):
+        return f"{self.item_id} on transaction {self.transaction_id}"
+
+
+class SweepCheckpoint(models.Model):
+    """
+    High-water mark of a periodic sweep: everything below `high_water` has
+    been processed, so the next run can start its index walk there.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    high_water = models.DateField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.high_water}"
+
+
+class NotificationLog(models.Model):
+    """
+    Ledger of alerts already pushed: one row per (transaction, kind, day).
+    notify_due_items skips loans that have a row for today's alert, so a
+    run with nothing new costs a single indexed anti-join.
+    """
+    KIND_CHOICES = [
+        ('due', 'Due Today'),
+        ('overdue', 'Overdue'),
+    ]
+    transaction = models.ForeignKey(
+        Transaction,
+        on_delete=models.CASCADE,
+        related_name='notifications'
+    )
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    day = models.DateField()
+    sent_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['transaction', 'kind', 'day'],
+                name='unique_notification_transaction_kind_day',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.transaction_id} {self.kind} @ {self.day}"
+
+
+class NotificationOutbox(models.Model):
+    """
+    Push notifications waiting for delivery (see outbox.py). Rows are
+    written in the same DB transaction as the event that triggers them and
+    drained by drain_notification_outbox, which retries failures with
+    exponential backoff until NOTIFY_OUTBOX_MAX_ATTEMPTS.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+        ('dead', 'Dead token'),
+    ]
+    fcm_token = models.CharField(max_length=255)
+    title = models.CharField(max_length=255)
+    body = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    # when the row may be claimed next (also the lease of a running drain)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # drain claims pending rows in next_attempt_at order
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.title} -> {self.fcm_token[:12]}… ({self.status})"
@@ -0,0 +1,148 @@
+# outbox.py
+"""
+Transactional outbox for push notifications. enqueue_pushes() writes
+NotificationOutbox rows inside the caller's DB transaction, so a push
+exists exactly when the event that caused it committed. drain() claims
+due rows with SELECT ... FOR UPDATE SKIP LOCKED, leases them by moving
+next_attempt_at forward, and sends them outside the transaction through
+firebase.send_pushes (concurrent send_each batches). Failures are retried
+with capped exponential backoff; dead tokens and exhausted rows are kept
+with their last error for inspection.
+"""
+import logging
+import random
+import statistics
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.db.models import F, Min
+from django.utils import timezone
+
+from .models import NotificationOutbox
+
+logger = logging.getLogger(__name__)
+
+LEASE = timedelta(minutes=5)  # a crashed drain's rows become claimable again after this
+
+
+def _kick():
+    from .tasks import drain_notification_outbox  # keep celery/firebase out of module import
+    try:
+        drain_notification_outbox.delay()
+    except Exception as e:
+        # the periodic drain picks the rows up
+        logger.warning(f"Could not queue outbox drain ({e})")
+
+
+def enqueue_pushes(pushes):
+    """
+    Add `pushes` (firebase.Push) to the outbox in the current DB transaction
+    and queue a drain once it commits. Returns the rows created.
+    """
+    rows = NotificationOutbox.objects.bulk_create([
+        NotificationOutbox(fcm_token=push.token, title=push.title, body=push.body)
+        for push in pushes if push.token
+    ])
+    if rows:
+        db_transaction.on_commit(_kick)
+    return rows
+
+
+def backoff(attempts):
+    """Delay before retry number `attempts`: exponential from the base, capped, with jitter."""
+    delay = min(settings.NOTIFY_OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1), settings.NOTIFY_OUTBOX_BACKOFF_MAX)
+    return timedelta(seconds=random.uniform(delay / 2, delay))
+
+
+def _claim(batch_size):
+    now = timezone.now()
+    with db_transaction.atomic():
+        rows = list(
+            NotificationOutbox.objects
+            .select_for_update(skip_locked=True)
+            .filter(status='pending', next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'id')[:batch_size]
+        )
+        if rows:
+            NotificationOutbox.objects.filter(pk__in=[row.pk for row in rows]).update(
+                attempts=F('attempts') + 1, next_attempt_at=now + LEASE
+            )
+    for row in rows:
+        row.attempts += 1
+    return rows
+
+
+def drain(batch_size=None, transport=None):
+    """
+    Deliver due outbox rows until none are left, `batch_size` per claim.
+    Returns counts of sent, retried, failed (gave up) and dead rows.
+    """
+    from .firebase import Push, send_pushes  # firebase_admin init only where pushes are sent
+
+    batch_size = batch_size or settings.NOTIFY_OUTBOX_BATCH_SIZE
+    counts = {"sent": 0, "retried": 0, "failed": 0, "dead": 0}
+    while True:
+        rows = _claim(batch_size)
+        if not rows:
+            return counts
+
+        results = send_pushes([Push(row.fcm_token, row.title, row.body) for row in rows], transport=transport)
+        now = timezone.now()
+        sent, retry = [], []
+        for row, result in zip(rows, results):
+            if result.success:
+                sent.append(row.pk)
+                continue
+            row.last_error = str(result.error)[:1000]
+            if result.dead:
+                row.status = 'dead'
+            elif row.attempts >= settings.NOTIFY_OUTBOX_MAX_ATTEMPTS:
+                row.status = 'failed'
+            else:
+                row.next_attempt_at = now + backoff(row.attempts)
+                counts["retried"] += 1
+            if row.status != 'pending':
+                counts[row.status] += 1
+            retry.append(row)
+
+        NotificationOutbox.objects.filter(pk__in=sent).update(status='sent', sent_at=now, last_error='')
+        NotificationOutbox.objects.bulk_update(retry, ['status', 'next_attempt_at', 'last_error'])
+        counts["sent"] += len(sent)
+
+
+def stats(window=timedelta(hours=1)):
+    """
+    Queue depth and delivery latency (created -> sent) over the last
+    `window`, for the outbox endpoint and drain logs.
+    """
+    now = timezone.now()
+    pending = NotificationOutbox.objects.filter(status='pending')
+    oldest = pending.aggregate(oldest=Min('created_at'))['oldest']
+    latencies = sorted(
+        (sent_at - created_at).total_seconds()
+        for created_at, sent_at in NotificationOutbox.objects
+        .filter(status='sent', sent_at__gte=now - window)
+        .order_by('-sent_at')
+        .values_list('created_at', 'sent_at')[:5000]
+    )
+    return {
+        "pending": pending.count(),
+        "due": pending.filter(next_attempt_at__lte=now).count(),
+        "retrying": pending.filter(attempts__gt=0).count(),
+        "failed": NotificationOutbox.objects.filter(status='failed').count(),
+        "dead": NotificationOutbox.objects.filter(status='dead').count(),
+        "oldest_pending_age_s": round((now - oldest).total_seconds(), 1) if oldest else 0,
+        "sent_last_window": len(latencies),
+        "latency_p50_s": round(statistics.median(latencies), 2) if latencies else None,
+        "latency_p95_s": round(latencies[int(0.95 * (len(latencies) - 1))], 2) if latencies else None,
+    }
+
+
+def prune(days=None):
+    """Delete sent and dead rows older than NOTIFY_OUTBOX_RETENTION_DAYS; failed rows stay for inspection."""
+    days = settings.NOTIFY_OUTBOX_RETENTION_DAYS if days is None else days
+    deleted, _ = NotificationOutbox.objects.filter(
+        status__in=('sent', 'dead'), created_at__lt=timezone.now() - timedelta(days=days)
+    ).delete()
+    return deleted
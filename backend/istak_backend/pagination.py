@@ -0,0 +1,110 @@
+# pagination.py
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (seek) pagination over `ordering`, which must end in a unique
+    column. The cursor is an opaque token holding the last row's ordering
+    values, so every page is a plain index range scan with no OFFSET.
+
+    Pagination is opt-in: clients that send neither `cursor` nor
+    `page_size` keep getting the full, unpaginated list.
+    """
+    ordering = ('-borrow_date', '-id')
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        default = getattr(settings, 'API_PAGE_SIZE', 50)
+        maximum = getattr(settings, 'API_MAX_PAGE_SIZE', 500)
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, default))
+        except (TypeError, ValueError):
+            page_size = default
+        return max(1, min(page_size, maximum))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+
+        encoded = params.get(self.cursor_query_param)
+        if encoded:
+            queryset = queryset.filter(self._after(queryset.model, self._decode(encoded)))
+
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        self.next_cursor = self._encode(rows[-1]) if self.has_next else None
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_next_link(self):
+        if not self.next_cursor:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.page_size_query_param, self.page_size)
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    # --- cursor helpers ---
+
+    def _fields(self):
+        return [(f.lstrip('-'), f.startswith('-')) for f in self.ordering]
+
+    def _encode(self, obj):
+        values = [str(getattr(obj, name)) for name, _ in self._fields()]
+        return urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def _decode(self, encoded):
+        try:
+            values = json.loads(urlsafe_b64decode(encoded.encode()))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+    def _after(self, model, values):
+        """Rows strictly after `values` in `ordering`: (a, b) > (x, y) as an OR of prefixes."""
+        try:
+            parsed = [
+                model._meta.get_field(name).to_python(value)
+                for (name, _), value in zip(self._fields(), values)
+            ]
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+        condition = Q()
+        equal = {}
+        for (name, descending), value in zip(self._fields(), parsed):
+            lookup = f"{name}__lt" if descending else f"{name}__gt"
+            condition |= Q(**equal, **{lookup: value})
+            equal[name] = value
+        return condition
+
+
+class TransactionPagination(KeysetPagination):
+    ordering = ('-borrow_date', '-id')
+
+
+class IdPagination(KeysetPagination):
+    ordering = ('id',)
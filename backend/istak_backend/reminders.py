@@ -0,0 +1,64 @@
+# reminders.py
+"""
+Due/overdue reminders scheduled per loan instead of found by polling.
+A checkout queues send_due_reminder with an ETA at the loan's due moment
+(NOTIFY_REMINDER_HOUR on the return date, and the same hour the day after
+for the overdue alert) in settings.TIME_ZONE (Asia/Manila). Only moments
+falling today are queued right away; plan_due_reminders queues each new
+day's just after midnight, so the broker never holds messages for more
+than a day. Returns, deletions and return-date edits don't revoke
+anything: the task re-reads the loan and does nothing unless it is still
+open with the date it was scheduled for.
+"""
+import logging
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+REMINDER_KINDS = ("due", "overdue")
+
+
+def reminder_moment(return_date, kind):
+    """Aware local datetime at which the `kind` alert for a loan returning on `return_date` goes out."""
+    day = return_date if kind == "due" else return_date + timedelta(days=1)
+    return timezone.make_aware(datetime.combine(day, time(settings.NOTIFY_REMINDER_HOUR)))
+
+
+def queue_reminders(transactions):
+    """Queue today's ETA reminders for (transaction_id, return_date) pairs. Returns how many were queued."""
+    from .tasks import send_due_reminder  # keep celery/firebase out of module import
+
+    now = timezone.now()
+    today = timezone.localdate()
+    queued = 0
+    for transaction_id, return_date in transactions:
+        if not return_date:
+            continue
+        for kind in REMINDER_KINDS:
+            moment = reminder_moment(return_date, kind)
+            if timezone.localdate(moment) != today:
+                continue  # earlier days go to the reconciler, later ones to plan_due_reminders
+            try:
+                send_due_reminder.apply_async(
+                    args=(transaction_id, kind, return_date.isoformat()),
+                    eta=max(moment, now),
+                )
+                queued += 1
+            except Exception as e:
+                logger.warning(f"Could not queue {kind} reminder for transaction {transaction_id} ({e})")
+    return queued
+
+
+def schedule_due_reminders(transactions):
+    """
+    Queue the reminders of `transactions` (Transaction instances) once the
+    current DB transaction commits. No-op unless NOTIFY_ETA_REMINDERS is on.
+    """
+    if not settings.NOTIFY_ETA_REMINDERS:
+        return
+    pending = [(tx.pk, tx.return_date) for tx in transactions]
+    db_transaction.on_commit(lambda: queue_reminders(pending))
@@ -1,13 +1,14 @@
-from datetime import datetime
 from io import BytesIO
+import json
+import re
 
-import requests
 from django.contrib.auth import get_user_model
-from django.core.files.base import ContentFile
+from django.db.models import Count, F, Max, OuterRef, Prefetch, Q, Subquery
 from django.utils import timezone as dj_timezone
 from rest_framework import serializers
 
 from istak_backend.models import (
+    ActiveLoan,
     Borrower,
     CustomUser,
     PredictiveItemCondition,
@@ -15,9 +16,13 @@ from istak_backend.models import (
     Transaction,
     Item,
 )
+from istak_backend.imaging import rendition_urls
 
 User = get_user_model()
 
+# Loan statuses that are still out; 'overdue' is set by sweep_overdue_transactions
+OPEN_STATUSES = ("borrowed", "overdue")
+
 
 # ---------- Helpers ----------
 
@@ -33,6 +38,11 @@ def _abs_url(request, f):
     return f.url
 
 
+def _renditions(request, obj, field="image"):
+    """Rendition map ({"thumb", "medium", "full"} -> URL) for an image field."""
+    return rendition_urls(request, getattr(obj, field), getattr(obj, f"{field}_renditions", None))
+
+
 # ---------- Serializers ----------
 
 class RegistrationRequestSerializer(serializers.ModelSerializer):
@@ -45,6 +55,7 @@ class BorrowerSerializer(serializers.ModelSerializer):
     borrowed_items = serializers.SerializerMethodField()
     transaction_count = serializers.SerializerMethodField()
     image = serializers.SerializerMethodField()
+    image_renditions = serializers.SerializerMethodField()
     total_borrowed_items = serializers.SerializerMethodField()
     last_borrowed_date = serializers.DateField(read_only=True, allow_null=True)
     current_borrow_date = serializers.SerializerMethodField()
@@ -58,6 +69,7 @@ class BorrowerSerializer(serializers.ModelSerializer):
             "school_id",
             "status",
             "image",
+            "image_renditions",
             "borrowed_items",
             "transaction_count",
             "total_borrowed_items",
@@ -66,42 +78,75 @@ class BorrowerSerializer(serializers.ModelSerializer):
             "return_image_url",
         ]
 
-    def get_borrowed_items(self, obj):
-        request = self.context.get("request")
-        user = getattr(request, "user", None)
-        qs = (
-            Transaction.objects.filter(borrower=obj, status="borrowed", mobile_user=user)
+    @staticmethod
+    def with_list_annotations(queryset, **scope):
+        """
+        List mode: precompute every per-borrower value in a constant number of
+        queries. `scope` filters the transactions that count (e.g.
+        mobile_user=user or manager=user); the serializer then reads the
+        annotated attributes instead of querying per row.
+        """
+        tx_scope = Q(**{f"transactions__{key}": value for key, value in scope.items()})
+        borrowed = tx_scope & Q(transactions__status="borrowed")
+        active_transactions = (
+            Transaction.objects.filter(status="borrowed", **scope)
+            .order_by("-borrow_date", "id")
             .prefetch_related("items")
         )
+        return queryset.annotate(
+            transaction_count=Count("transactions", filter=tx_scope, distinct=True),
+            total_borrowed_items=Count("transactions__items", filter=borrowed),
+            last_borrowed_date=Max("transactions__borrow_date", filter=tx_scope),
+            current_borrow_date=Max("transactions__borrow_date", filter=borrowed),
+        ).prefetch_related(
+            Prefetch("transactions", queryset=active_transactions, to_attr="active_transactions")
+        )
+
+    def _user(self):
+        request = self.context.get("request")
+        return getattr(request, "user", None)
+
+    def get_borrowed_items(self, obj):
+        active = getattr(obj, "active_transactions", None)
+        if active is None:
+            active = (
+                Transaction.objects.filter(borrower=obj, status="borrowed", mobile_user=self._user())
+                .prefetch_related("items")
+            )
         # avoid extra exists() per transaction
         names = []
-        for t in qs:
+        for t in active:
             first = next(iter(t.items.all()), None)
             if first:
                 names.append(first.item_name)
         return names
 
     def get_transaction_count(self, obj):
-        request = self.context.get("request")
-        user = getattr(request, "user", None)
-        return Transaction.objects.filter(borrower=obj, mobile_user=user).count()
+        if hasattr(obj, "transaction_count"):
+            return obj.transaction_count
+        return Transaction.objects.filter(borrower=obj, mobile_user=self._user()).count()
 
     def get_image(self, obj):
         return _abs_url(self.context.get("request"), obj.image)
 
+    def get_image_renditions(self, obj):
+        return _renditions(self.context.get("request"), obj)
+
     def get_return_image_url(self, obj):
         return _abs_url(self.context.get("request"), obj.return_image)
 
     def get_total_borrowed_items(self, obj):
-        request = self.context.get("request")
-        user = getattr(request, "user", None)
-        qs = (
-            Transaction.objects.filter(borrower=obj, status="borrowed", mobile_user=user)
-            .prefetch_related("items")
-        )
-        return sum(t.items.count() for t in qs)
+        if hasattr(obj, "total_borrowed_items"):
+            return obj.total_borrowed_items
+        return Transaction.items.through.objects.filter(
+            transaction__borrower=obj,
+            transaction__status="borrowed",
+            transaction__mobile_user=self._user(),
+        ).count()
 
     def get_current_borrow_date(self, obj):
+        if hasattr(obj, "current_borrow_date"):
+            return obj.current_borrow_date
         transaction = (
             Transaction.objects.filter(borrower=obj, status="borrowed")
             .order_by("-borrow_date")
@@ -138,7 +183,9 @@ class TransactionSerializer(serializers.ModelSerializer):
     def get_items(self, obj):
         request = self.context.get("request")
         out = []
-        for item in obj.items.all():
+        # views that already hold the Item rows (e.g. checkout) pass them as obj.cart_items
+        items = getattr(obj, "cart_items", None)
+        for item in (items if items is not None else obj.items.all()):
             out.append(
                 {
                     "id": item.id,
@@ -153,32 +200,61 @@ class TransactionSerializer(serializers.ModelSerializer):
 class TopBorrowedItemsSerializer(serializers.ModelSerializer):
     borrow_count = serializers.IntegerField()
     image = serializers.SerializerMethodField()
+    image_renditions = serializers.SerializerMethodField()
 
     class Meta:
         model = Item
-        fields = ["id", "item_name", "borrow_count", "image"]
+        fields = ["id", "item_name", "borrow_count", "image", "image_renditions"]
 
     def get_image(self, obj):
         return _abs_url(self.context.get("request"), obj.image)
 
+    def get_image_renditions(self, obj):
+        return _renditions(self.context.get("request"), obj)
 
-class CreateBorrowingSerializer(serializers.Serializer):
-    school_id = serializers.CharField(max_length=10)
-    name = serializers.CharField(max_length=255)
-    status = serializers.ChoiceField(choices=["active", "inactive"], default="active")
-    image = serializers.ImageField(required=False, allow_null=True)
-    return_date = serializers.DateField()
-    item_ids = serializers.ListField(child=serializers.CharField(), allow_empty=False)
+
+class ResolveItemIdsMixin:
+    """
+    Resolve `item_ids` with one `id__in` query and expose the Item instances
+    as validated_data["items"] (in request order). The queryset can be
+    narrowed through context: "manager" scopes it (even when None, so a user
+    without a manager only sees unassigned items), "items_queryset" replaces
+    the base queryset (e.g. select_for_update() inside the caller's atomic block).
+    """
+
+    def get_items_queryset(self):
+        queryset = self.context.get("items_queryset", Item.objects.all())
+        if "manager" in self.context:
+            queryset = queryset.filter(manager=self.context["manager"])
+        return queryset
 
     def validate_item_ids(self, value):
-        invalid = [iid for iid in value if not Item.objects.filter(id=iid).exists()]
+        value = list(dict.fromkeys(value))
+        found = {item.id: item for item in self.get_items_queryset().filter(id__in=value)}
+        invalid = [iid for iid in value if iid not in found]
         if invalid:
             raise serializers.ValidationError(
                 f"Invalid or non-existent item IDs: {invalid}"
             )
+        self._resolved_items = [found[iid] for iid in value]
         return value
 
     def validate(self, data):
+        data = super().validate(data)
+        data["items"] = self._resolved_items
+        return data
+
+
+class CreateBorrowingSerializer(ResolveItemIdsMixin, serializers.Serializer):
+    school_id = serializers.CharField(max_length=10)
+    name = serializers.CharField(max_length=255)
+    status = serializers.ChoiceField(choices=["active", "inactive"], default="active")
+    image = serializers.ImageField(required=False, allow_null=True)
+    return_date = serializers.DateField()
+    item_ids = serializers.ListField(child=serializers.CharField(), allow_empty=False)
+
+    def validate(self, data):
+        data = super().validate(data)
         # allow multipart image upload from request.FILES
         req = self.context.get("request")
         if req and "image" in req.FILES:
@@ -186,6 +262,72 @@ class CreateBorrowingSerializer(serializers.Serializer):
         return data
 
 
+class BulkCheckoutEntrySerializer(serializers.Serializer):
+    """
+    One checkout in a bulk request. Only field-level validation happens
+    here; items and borrowers are resolved for the whole batch at once.
+    """
+    school_id = serializers.CharField(max_length=10)
+    name = serializers.CharField(max_length=255)
+    status = serializers.ChoiceField(choices=["active", "inactive"], default="active")
+    return_date = serializers.DateField()
+    item_ids = serializers.ListField(child=serializers.CharField(), allow_empty=False)
+
+
+class ReturnItemEntrySerializer(serializers.Serializer):
+    item_id = serializers.CharField()
+    condition = serializers.CharField(max_length=Item._meta.get_field("condition").max_length)
+
+
+class ReturnItemSerializer(serializers.Serializer):
+    """
+    Return payload: {"school_id": "...", "items": [{"item_id", "condition"}]}.
+    Multipart requests may send `items` as a JSON string, or the legacy
+    `items[i][itemId]` / `items[i][condition]` form fields.
+    """
+    school_id = serializers.CharField(max_length=10, required=False, allow_blank=True)
+    items = ReturnItemEntrySerializer(many=True, allow_empty=False)
+
+    LEGACY_ITEM_FIELD = re.compile(r"^items\[(\d+)\]\[(itemId|item_id|condition)\]$")
+
+    def to_internal_value(self, data):
+        items = data.get("items")
+        if isinstance(items, str):
+            try:
+                items = json.loads(items)
+            except ValueError:
+                raise serializers.ValidationError({"items": ["Must be a JSON list."]})
+        elif items is None:
+            legacy = {}
+            for key in data.keys():
+                match = self.LEGACY_ITEM_FIELD.match(key)
+                if match:
+                    field = "condition" if match.group(2) == "condition" else "item_id"
+                    legacy.setdefault(int(match.group(1)), {})[field] = data.get(key)
+            items = [legacy[i] for i in sorted(legacy)]
+        values = {name: data.get(name) for name in self.fields if name in data}
+        values["items"] = items or []
+        return super().to_internal_value(values)
+
+    def validate_items(self, value):
+        ids = [entry["item_id"] for entry in value]
+        if len(set(ids)) != len(ids):
+            raise serializers.ValidationError("Duplicate item IDs in return.")
+        return value
+
+
+class ReturnAllItemsSerializer(ReturnItemSerializer):
+    """
+    Return every open loan of a borrower. `condition` applies to all items;
+    entries in `items` override it per item.
+    """
+    school_id = serializers.CharField(max_length=10)
+    condition = serializers.CharField(
+        max_length=Item._meta.get_field("condition").max_length, required=False, allow_blank=False
+    )
+    items = ReturnItemEntrySerializer(many=True, required=False)
+
+
 class DamagedOverdueReportSerializer(serializers.ModelSerializer):
     borrowerName = serializers.CharField(source="borrower.name")
     school_id = serializers.CharField(source="borrower.school_id")
@@ -215,7 +357,7 @@ class DamagedOverdueReportSerializer(serializers.ModelSerializer):
         ):
             return "Damaged"
         if (
-            obj.status == "borrowed"
+            obj.status in OPEN_STATUSES
             and obj.return_date
             and obj.return_date < dj_timezone.now().date()
         ):
@@ -224,7 +366,7 @@ class DamagedOverdueReportSerializer(serializers.ModelSerializer):
 
     def get_daysPastDue(self, obj):
         if (
-            obj.status == "borrowed"
+            obj.status in OPEN_STATUSES
             and obj.return_date
             and obj.return_date < dj_timezone.now().date()
         ):
@@ -233,9 +375,15 @@ class DamagedOverdueReportSerializer(serializers.ModelSerializer):
 
 
 class ItemSerializer(serializers.ModelSerializer):
+    """
+    `transactions` is only included when the serializer context carries
+    `history` (the N most recent loans to embed; the item views default
+    to the latest one).
+    """
     image = serializers.SerializerMethodField()
+    image_renditions = serializers.SerializerMethodField()
     last_transaction_return_date = serializers.SerializerMethodField()
-    transactions = TransactionSummarySerializer(many=True, read_only=True)
+    transactions = serializers.SerializerMethodField()
     current_transaction = serializers.SerializerMethodField()
 
     class Meta:
@@ -245,79 +393,68 @@ class ItemSerializer(serializers.ModelSerializer):
             "item_name",
             "condition",
             "image",
+            "image_renditions",
             "last_transaction_return_date",
             "transactions",
             "current_transaction",
+            "image_status",
         ]
+        read_only_fields = ["image_status"]
         extra_kwargs = {"manager": {"read_only": True}}
 
+    @staticmethod
+    def with_list_annotations(queryset, history=None):
+        """
+        Annotate the last return date (subquery) and current transaction
+        (the item's active loan), and prefetch at most `history` recent transactions per
+        item, so a listing runs in a constant number of queries.
+        """
+        item_transactions = Transaction.objects.filter(items=OuterRef("pk"))
+        queryset = queryset.annotate(
+            last_return_date=Subquery(
+                item_transactions.filter(status="returned")
+                .order_by("-return_date").values("return_date")[:1]
+            ),
+            current_transaction_id=F("active_loan__transaction_id"),
+        )
+        if history:
+            recent = Transaction.objects.order_by("-borrow_date", "-id")[:history]
+            queryset = queryset.prefetch_related(
+                Prefetch("transactions", queryset=recent, to_attr="recent_transactions")
+            )
+        return queryset
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if not self.context.get("history"):
+            fields.pop("transactions")
+        return fields
+
     def get_image(self, obj):
         return _abs_url(self.context.get("request"), obj.image)
 
+    def get_image_renditions(self, obj):
+        return _renditions(self.context.get("request"), obj)
+
     def get_last_transaction_return_date(self, obj):
+        if hasattr(obj, "last_return_date"):
+            return obj.last_return_date
         last_transaction = (
             obj.transactions.filter(status="returned").order_by("-return_date").first()
         )
         return last_transaction.return_date if last_transaction else None
 
-    def get_current_transaction(self, obj):
-        t = obj.transactions.filter(status="borrowed").first()
-        return t.id if t else None
-
+    def get_transactions(self, obj):
+        recent = getattr(obj, "recent_transactions", None)
+        if recent is None:
+            recent = obj.transactions.order_by("-borrow_date", "-id")[: self.context["history"]]
+        return TransactionSummarySerializer(recent, many=True).data
 
-class CreateBorrowingSerializerWithURL(serializers.Serializer):
-    school_id = serializers.CharField(max_length=10)
-    name = serializers.CharField(max_length=255)
-    status = serializers.ChoiceField(choices=["active", "inactive"], default="active")
-    image_url = serializers.URLField(required=False, allow_null=True)
-    return_date = serializers.DateField()
-    item_ids = serializers.ListField(child=serializers.CharField(), allow_empty=False)
-
-    def validate_item_ids(self, value):
-        invalid = [iid for iid in value if not Item.objects.filter(id=iid).exists()]
-        if invalid:
-            raise serializers.ValidationError(
-                f"Invalid or non-existent item IDs: {invalid}"
-            )
-        return value
-
-    def validate(self, data):
-        url = data.get("image_url")
-        if url:
-            try:
-                resp = requests.get(url, timeout=10)
-                if resp.status_code == 200 and resp.content:
-                    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    name = f"borrower_image_{ts}.png"
-                    data["image"] = ContentFile(resp.content, name=name)
-                else:
-                    raise serializers.ValidationError("Failed to download image from URL")
-            except Exception as e:
-                raise serializers.ValidationError(f"Invalid image URL: {e}")
-        return data
-
-    def create(self, validated_data):
-        image = validated_data.pop("image", None)
-        borrower_defaults = {
-            "name": validated_data["name"],
-            "status": validated_data["status"],
-        }
-        if image:
-            borrower_defaults["image"] = image
-
-        borrower, _ = Borrower.objects.get_or_create(
-            school_id=validated_data["school_id"], defaults=borrower_defaults
-        )
-
-        tx = Transaction.objects.create(
-            borrower=borrower,
-            mobile_user=getattr(self.context.get("request"), "user", None),
-            status="borrowed",
-            borrow_date=dj_timezone.now().date(),
-            return_date=validated_data["return_date"],
-        )
-        tx.items.set(validated_data["item_ids"])
-        return tx
+    def get_current_transaction(self, obj):
+        if hasattr(obj, "current_transaction_id"):
+            return obj.current_transaction_id
+        loan = ActiveLoan.objects.filter(item=obj).only("transaction_id").first()
+        return loan.transaction_id if loan else None
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -365,7 +502,7 @@ class TransactionReportSerializer(serializers.ModelSerializer):
         return [{"itemName": i.item_name, "condition": i.condition or "Good"} for i in obj.items.all()]
 
     def get_daysPastDue(self, obj):
-        if obj.status == "borrowed" and obj.return_date:
+        if obj.status in OPEN_STATUSES and obj.return_date:
             today = dj_timezone.now().date()
             if obj.return_date < today:
                 return (today - obj.return_date).days
@@ -375,6 +512,12 @@ class TransactionReportSerializer(serializers.ModelSerializer):
 from .models import Item
 
 class SimpleItemSerializer(serializers.ModelSerializer):
+    image_renditions = serializers.SerializerMethodField()
+
     class Meta:
         model = Item
-        fields = ['id', 'item_name', 'image']
\ No newline at end of file
+        fields = ['id', 'item_name', 'image', 'image_status', 'image_renditions']
+        read_only_fields = ['image_status']
+
+    def get_image_renditions(self, obj):
+        return _renditions(self.context.get("request"), obj)
\ No newline at end of file
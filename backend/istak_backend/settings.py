@@ -124,6 +124,9 @@ REST_FRAMEWORK = {
     ),
     "DEFAULT_PERMISSION_CLASSES": ("rest_framework.permissions.IsAuthenticated",),
 }
+# Keyset pagination (opt-in via ?page_size= / ?cursor=, see istak_backend/pagination.py)
+API_PAGE_SIZE = int(os.getenv("API_PAGE_SIZE", "50"))
+API_MAX_PAGE_SIZE = int(os.getenv("API_MAX_PAGE_SIZE", "500"))
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=60),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=7),
@@ -170,6 +173,8 @@ CACHES = {
         "TIMEOUT": None,
     }
 }
+# Seconds a cached dashboard summary may live (writes invalidate it sooner)
+INVENTORY_SUMMARY_CACHE_TTL = int(os.getenv("INVENTORY_SUMMARY_CACHE_TTL", "60"))
 
 # # --- Celery / Redis ---
 REDIS_URL = os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0")
@@ -179,10 +184,60 @@ CELERY_ACCEPT_CONTENT = ["json"]
 CELERY_TASK_SERIALIZER = "json"
 CELERY_RESULT_SERIALIZER = "json"
 CELERY_TIMEZONE = "Asia/Manila"
-
-CELERY_BEAT_SCHEDULE = {
-    "notify-due-overdue-every-2min": {
-        "task": "istak_backend.tasks.notify_due_items",
-        "schedule": 60,  # seconds
-    },
-}
+# Redis redelivers unacked messages after this long; ETA reminders wait up
+# to a day in the worker (see reminders.py), so keep it above 24h.
+CELERY_BROKER_TRANSPORT_OPTIONS = {"visibility_timeout": 25 * 3600}
+
+# Periodic tasks are declared in celery.py (app.conf.beat_schedule)
+
+# --- Push notifications ---
+# "fake" swaps FCM for a local stub (firebase.FakeTransport) for load tests
+FCM_TRANSPORT = os.getenv("FCM_TRANSPORT", "firebase")
+FCM_MAX_CONCURRENCY = int(os.getenv("FCM_MAX_CONCURRENCY", "4"))
+# One summary push per mobile user instead of one per transaction
+NOTIFY_DIGEST = os.getenv("NOTIFY_DIGEST", "true").lower() in ("1", "true", "yes")
+NOTIFY_DIGEST_TOP_BORROWERS = int(os.getenv("NOTIFY_DIGEST_TOP_BORROWERS", "3"))
+# Queue a Celery task per loan at its due moment instead of polling
+# (needs a broker; notify_due_items then only reconciles missed alerts)
+NOTIFY_ETA_REMINDERS = os.getenv(
+    "NOTIFY_ETA_REMINDERS", "true" if os.getenv("REDIS_URL") else "false"
+).lower() in ("1", "true", "yes")
+# Local (TIME_ZONE) hour of the due-today and overdue reminders
+NOTIFY_REMINDER_HOUR = int(os.getenv("NOTIFY_REMINDER_HOUR", "8"))
+# Outbox drain (outbox.py): rows per claim, retry schedule, retention
+NOTIFY_OUTBOX_BATCH_SIZE = int(os.getenv("NOTIFY_OUTBOX_BATCH_SIZE", "2000"))
+NOTIFY_OUTBOX_MAX_ATTEMPTS = int(os.getenv("NOTIFY_OUTBOX_MAX_ATTEMPTS", "8"))
+NOTIFY_OUTBOX_BACKOFF_BASE = int(os.getenv("NOTIFY_OUTBOX_BACKOFF_BASE", "30"))  # seconds
+NOTIFY_OUTBOX_BACKOFF_MAX = int(os.getenv("NOTIFY_OUTBOX_BACKOFF_MAX", "3600"))  # seconds
+NOTIFY_OUTBOX_RETENTION_DAYS = int(os.getenv("NOTIFY_OUTBOX_RETENTION_DAYS", "7"))
+
+# --- Item image processing ---
+# "celery" hands background removal to the worker; "thread" runs it on a
+# bounded in-process pool (default when no REDIS_URL/broker is configured).
+IMAGE_PROCESSING_BACKEND = os.getenv(
+    "IMAGE_PROCESSING_BACKEND", "celery" if os.getenv("REDIS_URL") else "thread"
+)
+IMAGE_PROCESSING_THREADS = int(os.getenv("IMAGE_PROCESSING_THREADS", "1"))
+IMAGE_PROCESSING_MAX_PENDING = int(os.getenv("IMAGE_PROCESSING_MAX_PENDING", "16"))
+# Items still 'processing' this long after their job was queued (lost to a
+# recycled worker or a crash) are requeued, up to IMAGE_PROCESSING_MAX_ATTEMPTS
+# jobs in all, then marked 'failed'. Swept every IMAGE_PROCESSING_SWEEP_INTERVAL.
+IMAGE_PROCESSING_TIMEOUT = int(os.getenv("IMAGE_PROCESSING_TIMEOUT", "600"))  # seconds
+IMAGE_PROCESSING_MAX_ATTEMPTS = int(os.getenv("IMAGE_PROCESSING_MAX_ATTEMPTS", "3"))
+IMAGE_PROCESSING_SWEEP_INTERVAL = int(os.getenv("IMAGE_PROCESSING_SWEEP_INTERVAL", "300"))  # seconds
+# Uploads are decoded no larger than this (longest side, px) and rejected
+# above IMAGE_MAX_PIXELS before decoding
+IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", "1024"))
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", "40000000"))
+# WebP renditions served by list endpoints (longest side, px)
+IMAGE_RENDITIONS = {"thumb": 128, "medium": 512, "full": IMAGE_MAX_DIMENSION}
+IMAGE_WEBP_QUALITY = int(os.getenv("IMAGE_WEBP_QUALITY", "80"))
+# Borrower capture/return photos: overlay font size and lossy encoding
+WATERMARK_FONT_SIZE = int(os.getenv("WATERMARK_FONT_SIZE", "24"))
+WATERMARK_FORMAT = os.getenv("WATERMARK_FORMAT", "JPEG")
+WATERMARK_QUALITY = int(os.getenv("WATERMARK_QUALITY", "85"))
+# rembg model (e.g. "u2netp" is ~25x smaller than "u2net"), ONNX intra-op
+# threads (0 = onnxruntime default) and whether workers load it at start
+REMBG_MODEL = os.getenv("REMBG_MODEL", "u2net")
+REMBG_THREADS = int(os.getenv("REMBG_THREADS", "0"))
+REMBG_PREWARM = os.getenv("REMBG_PREWARM", "1").lower() in ("1", "true", "yes")
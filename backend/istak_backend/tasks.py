@@ -1,83 +1,322 @@
 # istak_backend/tasks.py
+from collections import Counter
+from datetime import timedelta
+
 from celery import shared_task
+from django.conf import settings
+from django.db import transaction as db_transaction
 from django.utils import timezone
-from django.db.models import Q
-from istak_backend.models import Transaction
-from istak_backend.firebase import send_push_notification
+from django.db.models import Case, CharField, Exists, OuterRef, Q, Value, When
+from istak_backend.models import CustomUser, Item, NotificationLog, PredictiveItemCondition, SweepCheckpoint, Transaction
+from istak_backend.firebase import Push
+from istak_backend.analytics import mark_predictions_dirty, overdue_q, record_transition, refresh_predictions
+from istak_backend.imaging import generate_renditions, process_item_image
+from istak_backend.reminders import queue_reminders
+from istak_backend import imaging, outbox
+
+def _pending_alerts(today, **filters):
+    """
+    Loans (narrowed by `filters`) owed an alert today that the
+    NotificationLog ledger has not recorded yet, with the fields the
+    messages need:
+      - 'due'     (status='borrowed' and return_date=today)
+      - 'overdue' (analytics.overdue_q: marked by the sweep or past its return date)
+    """
+    return list(
+        Transaction.objects
+        .filter(Q(status='borrowed', return_date=today) | overdue_q(today), **filters)
+        .filter(Exists(Transaction.items.through.objects.filter(transaction_id=OuterRef('pk'))))
+        .exclude(mobile_user__fcm_token__isnull=True)
+        .exclude(mobile_user__fcm_token='')
+        .annotate(kind=Case(When(overdue_q(today), then=Value('overdue')), default=Value('due'),
+                            output_field=CharField()))
+        .exclude(Exists(NotificationLog.objects.filter(transaction_id=OuterRef('pk'), kind=OuterRef('kind'), day=today)))
+        .values('id', 'kind', 'return_date', 'mobile_user_id', 'mobile_user__fcm_token', 'borrower__school_id')
+    )
+
+
+def _transaction_pushes(alerts, today):
+    """One push per loan, naming its items."""
+    item_names = {}
+    links = (
+        Transaction.items.through.objects
+        .filter(transaction_id__in=[alert['id'] for alert in alerts])
+        .values_list('transaction_id', 'item__item_name')
+    )
+    for transaction_id, item_name in links:
+        item_names.setdefault(transaction_id, []).append(item_name)
+
+    pushes = []
+    for alert in alerts:
+        names = ", ".join(item_names.get(alert['id'], []))
+        borrower_id = alert['borrower__school_id'] or 'Unknown'
+        if alert['kind'] == 'due':
+            push = Push(
+                alert['mobile_user__fcm_token'],
+                "Item(s) Due Today",
+                f"School ID: {borrower_id} must return '{names}' today."
+            )
+        else:
+            days_overdue = max((today - alert['return_date']).days, 0) if alert['return_date'] else 0
+            push = Push(
+                alert['mobile_user__fcm_token'],
+                "ITEM OVERDUE!",
+                f"School ID: {borrower_id} hasn’t returned'{names}' "
+                f"for {days_overdue} day(s)."
+            )
+        pushes.append((push, [alert]))
+    return pushes
+
+
+def _digest_pushes(alerts):
+    """
+    One summary push per mobile user instead of one per transaction:
+    due/overdue counts plus the borrowers with the most loans in it.
+    """
+    digests = {}
+    for alert in alerts:
+        digest = digests.setdefault(alert['mobile_user__fcm_token'], {"due": 0, "overdue": 0, "borrowers": Counter(), "alerts": []})
+        digest[alert['kind']] += 1
+        digest["borrowers"][alert['borrower__school_id'] or 'Unknown'] += 1
+        digest["alerts"].append(alert)
+
+    pushes = []
+    top_n = settings.NOTIFY_DIGEST_TOP_BORROWERS
+    for token, digest in digests.items():
+        counts = []
+        if digest["due"]:
+            counts.append(f"{digest['due']} due today")
+        if digest["overdue"]:
+            counts.append(f"{digest['overdue']} overdue")
+        top = digest["borrowers"].most_common(top_n)
+        body = f"{', '.join(counts)}. Top borrowers (School ID): " + ", ".join(
+            f"{school_id} ({loans})" for school_id, loans in top
+        )
+        if len(digest["borrowers"]) > top_n:
+            body += f" and {len(digest['borrowers']) - top_n} more"
+        title = "ITEM OVERDUE!" if digest["overdue"] else "Item(s) Due Today"
+        pushes.append((Push(token, title, body + "."), digest["alerts"]))
+    return pushes
+
+
+def _lock_users(user_ids):
+    """Row-lock mobile users (in id order) so only one run turns their alerts into pushes at a time."""
+    list(CustomUser.objects.select_for_update().filter(pk__in=sorted(user_ids)).order_by('pk').values_list('pk', flat=True))
+
+
+def _enqueue_alerts(alerts, today, digest):
+    """
+    Turn `alerts` into pushes (digest or one per loan) in the outbox and
+    record them in the ledger, in the caller's DB transaction. Returns
+    (pushes queued, alerts logged).
+    """
+    pushes = _digest_pushes(alerts) if digest else _transaction_pushes(alerts, today)
+    queued = outbox.enqueue_pushes([push for push, _ in pushes])
+    NotificationLog.objects.bulk_create([
+        NotificationLog(transaction_id=alert['id'], kind=alert['kind'], day=today)
+        for alert in alerts
+    ], ignore_conflicts=True)
+    return len(queued), len(alerts)
+
 
 @shared_task
-def notify_due_items():
+def notify_due_items(digest=None):
     """
-    Check all transactions daily (or every few minutes for testing)
-    and send FCM notifications for:
-      - Due Today (status='borrowed' and return_date=today)
-      - Overdue (status='borrowed' and return_date<today, or status='overdue')
+    Reconciler for the ETA reminders (see reminders.py): queues FCM
+    notifications for loans due today or overdue that no reminder has
+    covered yet, once per loan, kind and day. Alerts are recorded in
+    NotificationLog together with their outbox rows, and the outbox drain
+    retries delivery (see outbox.py).
+    In digest mode (settings.NOTIFY_DIGEST, or `digest=True`) each mobile
+    user gets one summary push instead of one per transaction.
     """
-    today = timezone.now().date()
+    today = timezone.localdate()
+    if digest is None:
+        digest = settings.NOTIFY_DIGEST
+
+    alerts = _pending_alerts(today)
+    if not alerts:
+        print(f"[notify_due_items] {timezone.now()} | nothing new")
+        return "Queued 0 notifications"
+
+    due_count = sum(1 for alert in alerts if alert['kind'] == 'due')
+    print(f"[notify_due_items] {timezone.now()} | due_today={due_count} | overdue={len(alerts) - due_count} | digest={digest}")
 
-    # --- 1️⃣ DUE TODAY ---
-    due_qs = (
+    user_ids = {alert['mobile_user_id'] for alert in alerts}
+    with db_transaction.atomic():
+        _lock_users(user_ids)
+        # re-read under the locks: a reminder may have covered some meanwhile
+        alerts = _pending_alerts(today, mobile_user_id__in=user_ids)
+        queued, logged = _enqueue_alerts(alerts, today, digest)
+
+    print(f"[notify_due_items] Finished | queued={queued} | logged={logged}")
+    return f"Queued {queued} notifications covering {logged} alerts"
+
+
+@shared_task(ignore_result=True)
+def send_due_reminder(transaction_id, kind, return_date):
+    """
+    ETA reminder queued at checkout (reminders.schedule_due_reminders).
+    No-op when the loan was returned, deleted or moved to another return
+    date since it was scheduled, or when the alert was already sent.
+    An 'overdue' reminder marks the loan overdue itself if the sweep has
+    not reached it yet. In digest mode it covers every pending alert of the
+    loan's mobile user, so the user's other reminders that day find nothing.
+    """
+    today = timezone.localdate()
+    tx = (
         Transaction.objects
-        .filter(
-            status='borrowed',
-            return_date=today,
-            items__isnull=False
-        )
-        .select_related('mobile_user', 'borrower')
-        .prefetch_related('items')
-        .distinct()
+        .filter(pk=transaction_id, return_date=return_date, status__in=('borrowed', 'overdue'))
+        .values('status', 'mobile_user_id')
+        .first()
     )
+    if not tx or not tx['mobile_user_id']:
+        return "no-op"
+
+    if kind == 'overdue' and tx['status'] == 'borrowed':
+        with db_transaction.atomic():
+            if list(Transaction.objects.select_for_update().filter(pk=transaction_id, status='borrowed').values_list('pk', flat=True)):
+                _mark_overdue([transaction_id])
+
+    digest = settings.NOTIFY_DIGEST
+    with db_transaction.atomic():
+        _lock_users([tx['mobile_user_id']])
+        scope = {'mobile_user_id': tx['mobile_user_id']} if digest else {'pk': transaction_id}
+        alerts = _pending_alerts(today, **scope)
+        if not any(alert['id'] == transaction_id and alert['kind'] == kind for alert in alerts):
+            return "no-op"
+        queued, logged = _enqueue_alerts(alerts, today, digest)
 
-    # --- 2️⃣ OVERDUE ---
-    overdue_qs = (
+    print(f"[send_due_reminder] {kind} | transaction={transaction_id} | queued={queued} | logged={logged}")
+    return f"Queued {kind} reminder covering {logged} alerts"
+
+
+@shared_task
+def plan_due_reminders():
+    """
+    Queue the day's ETA reminders (see reminders.py) for loans due today,
+    or due yesterday and still open. Walks the (status, return_date)
+    index, so the work scales with loans due per day.
+    """
+    if not settings.NOTIFY_ETA_REMINDERS:
+        return 0
+    today = timezone.localdate()
+    transactions = (
         Transaction.objects
-        .filter(items__isnull=False)
-        .filter(
-            Q(status='overdue') |
-            (Q(status='borrowed') & Q(return_date__lt=today))
-        )
-        .select_related('mobile_user', 'borrower')
-        .prefetch_related('items')
-        .distinct()
+        .filter(status__in=('borrowed', 'overdue'), return_date__in=[today - timedelta(days=1), today])
+        .values_list('id', 'return_date')
     )
+    queued = queue_reminders(list(transactions))
+    print(f"[plan_due_reminders] Finished | queued={queued}")
+    return queued
+
+
+@shared_task
+def recompute_item_predictions(batch_size=500):
+    """
+    Recompute stored damage-risk predictions for items flagged dirty since
+    the last run (checked out, returned, or edited), plus rows older than a
+    day so the 90-day window keeps moving. New items get a row first.
+    """
+    missing = list(Item.objects.filter(prediction__isnull=True).values_list('id', flat=True))
+    mark_predictions_dirty(missing)
+
+    stale_before = timezone.now() - timedelta(days=1)
+    total = 0
+    while True:
+        with db_transaction.atomic():
+            batch = list(
+                PredictiveItemCondition.objects.select_for_update(skip_locked=True)
+                .filter(Q(is_dirty=True) | Q(last_checked__lt=stale_before))
+                .order_by('id')[:batch_size]
+            )
+            if not batch:
+                break
+            refresh_predictions(batch)
+        total += len(batch)
 
-    print(f"[notify_due_items] {timezone.now()} | due_today={due_qs.count()} | overdue={overdue_qs.count()}")
+    print(f"[recompute_item_predictions] Finished | recomputed={total}")
+    return f"Recomputed {total} predictions"
 
-    sent_count = 0
 
-    # --- 🔔 DUE TODAY NOTIFICATIONS ---
-    for tx in due_qs:
-        token = getattr(tx.mobile_user, 'fcm_token', None)
-        if not token:
-            continue
+def _mark_overdue(ids):
+    """Flip the borrowed transactions `ids` to 'overdue' with their rollup and prediction updates."""
+    batch = Transaction.objects.filter(id__in=ids)
+    record_transition(batch, 'borrowed', 'overdue')
+    mark_predictions_dirty(
+        Transaction.items.through.objects.filter(transaction_id__in=ids).values_list('item_id', flat=True)
+    )
+    return batch.update(status='overdue')
 
-        item_names = ", ".join(i.item_name for i in tx.items.all())
-        borrower_id = getattr(tx.borrower, 'school_id', 'Unknown')
 
-        send_push_notification(
-            token,
-            "Item(s) Due Today",
-            f"School ID: {borrower_id} must return '{item_names}' today."
-        )
-        sent_count += 1
-
-    # --- 🔔 OVERDUE NOTIFICATIONS ---
-    for tx in overdue_qs:
-        token = getattr(tx.mobile_user, 'fcm_token', None)
-        if not token:
-            continue
-
-        days_overdue = max((today - tx.return_date).days, 0) if tx.return_date else 0
-        item_names = ", ".join(i.item_name for i in tx.items.all())
-        borrower_id = getattr(tx.borrower, 'school_id', 'Unknown')
-
-        send_push_notification(
-            token,
-            "ITEM OVERDUE!",
-            f"School ID: {borrower_id} hasn’t returned'{item_names}' "
-            f"for {days_overdue} day(s)."
-        )
-        sent_count += 1
+@shared_task
+def sweep_overdue_transactions(batch_size=500, full=False):
+    """
+    Flip borrowed transactions whose return_date has passed to 'overdue'.
+    Walks the (status, return_date) index from the stored high-water mark
+    in batches of `batch_size`, each in its own DB transaction together
+    with its rollup and prediction updates. `full=True` ignores the mark
+    (catches loans back-dated or edited below it).
+    """
+    today = timezone.localdate()
+    checkpoint, _ = SweepCheckpoint.objects.get_or_create(name='overdue_transactions')
+
+    due = Transaction.objects.filter(status='borrowed', return_date__lt=today)
+    if checkpoint.high_water and not full:
+        due = due.filter(return_date__gte=checkpoint.high_water)
+
+    total = 0
+    while True:
+        with db_transaction.atomic():
+            ids = list(
+                due.select_for_update()
+                .order_by('return_date', 'id')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            total += _mark_overdue(ids)
+
+    SweepCheckpoint.objects.filter(pk=checkpoint.pk).update(high_water=today, updated_at=timezone.now())
+    print(f"[sweep_overdue_transactions] Finished | flipped={total} | high_water={today}")
+    return total
+
+
+@shared_task(ignore_result=True)
+def remove_item_background(item_id):
+    """Background removal for a freshly uploaded item image (see imaging.py)."""
+    process_item_image(item_id)
+
 
-    print(f"[notify_due_items] Finished | total_sent={sent_count}")
-    return f"Sent {sent_count} notifications (due={due_qs.count()}, overdue={overdue_qs.count()})"
+@shared_task
+def requeue_stuck_item_images():
+    """Requeue (or give up on) item images stuck in 'processing' (see imaging.py)."""
+    requeued, failed = imaging.requeue_stuck_item_images()
+    if requeued or failed:
+        print(f"[requeue_stuck_item_images] Finished | requeued={requeued} | failed={failed}")
+    return requeued, failed
+
+
+@shared_task(ignore_result=True)
+def build_image_renditions(model_label, pk, field_name="image"):
+    """WebP thumb/medium/full renditions for an uploaded image (see imaging.py)."""
+    generate_renditions(model_label, pk, field_name)
+
+
+@shared_task(ignore_result=True)
+def drain_notification_outbox(batch_size=None):
+    """Deliver due outbox rows (see outbox.py); queued after each enqueue and run every minute."""
+    counts = outbox.drain(batch_size)
+    if any(counts.values()):
+        depth = outbox.stats()
+        print(f"[drain_notification_outbox] Finished | {counts} | pending={depth['pending']} "
+              f"| oldest_pending_age_s={depth['oldest_pending_age_s']} | latency_p95_s={depth['latency_p95_s']}")
+    return counts
+
+
+@shared_task
+def prune_notification_outbox():
+    """Delete delivered outbox rows past NOTIFY_OUTBOX_RETENTION_DAYS."""
+    deleted = outbox.prune()
+    print(f"[prune_notification_outbox] Finished | deleted={deleted}")
+    return deleted
@@ -0,0 +1,246 @@
+import threading
+from datetime import date, timedelta
+from unittest import skipUnless
+
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone as dj_timezone
+from rest_framework.test import APIClient
+
+from .imaging import requeue_stuck_item_images
+from .models import ActiveLoan, Borrower, CustomUser, Item, PredictiveItemCondition, Transaction
+
+
+def make_loans(manager, items, borrower, count, status='borrowed', borrow_date=None):
+    """`count` transactions of `manager`, each lending all of `items`."""
+    borrow_date = borrow_date or date.today() - timedelta(days=10)
+    transactions = []
+    for _ in range(count):
+        tx = Transaction.objects.create(
+            borrower=borrower,
+            borrow_date=borrow_date,
+            return_date=borrow_date + timedelta(days=3),
+            status=status,
+            manager=manager,
+        )
+        tx.items.set(items)
+        transactions.append(tx)
+    return transactions
+
+
+class PredictiveDamageInsightQueryTests(TestCase):
+    """The insight endpoint's query count must not grow with the catalog."""
+
+    url = '/api/predictive/insights/'
+
+    def setUp(self):
+        self.borrower = Borrower.objects.create(name='Borrower', school_id='1000')
+
+    def catalog(self, username, size):
+        manager = CustomUser.objects.create_user(username, password='x', role='user_web')
+        items = [
+            Item.objects.create(item_name=f'{username}-{i}', manager=manager, condition='Good' if i % 2 else 'damaged')
+            for i in range(size)
+        ]
+        make_loans(manager, items[:3], self.borrower, 4)
+        client = APIClient()
+        client.force_authenticate(manager)
+        return client
+
+    def count_queries(self, client):
+        with CaptureQueriesContext(connection) as ctx:
+            response = client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response
+
+    def test_same_query_count_for_small_and_large_catalogs(self):
+        small = self.catalog('small', 3)
+        large = self.catalog('large', 60)
+
+        # first request scores the never-scored items
+        first_small, _ = self.count_queries(small)
+        with self.assertNumQueries(first_small):
+            response = large.get(self.url)
+        self.assertEqual(len(response.data), 60)
+        self.assertEqual(PredictiveItemCondition.objects.filter(is_dirty=True).count(), 0)
+
+        # later requests only read the stored predictions
+        steady_small, _ = self.count_queries(small)
+        with self.assertNumQueries(steady_small):
+            large.get(self.url)
+
+
+@skipUnless(connection.vendor == 'postgresql', "needs row locks (select_for_update is a no-op on SQLite)")
+class ConcurrentCheckoutTests(TransactionTestCase):
+    """Simultaneous checkouts of one item: the row lock lets exactly one through."""
+
+    threads = 8
+
+    def test_only_one_checkout_of_an_item_succeeds(self):
+        manager = CustomUser.objects.create_user('manager', password='x', role='user_web')
+        item = Item.objects.create(item_name='Camera', manager=manager)
+        return_date = (date.today() + timedelta(days=3)).isoformat()
+        start = threading.Barrier(self.threads)
+        codes = []
+
+        def checkout(n):
+            client = APIClient()
+            client.force_authenticate(manager)
+            try:
+                start.wait()
+                response = client.post('/api/borrowing/create/', {
+                    'school_id': f'20{n}',  # distinct borrowers, so no duplicate-replay shortcut
+                    'name': f'Borrower {n}',
+                    'status': 'active',
+                    'return_date': return_date,
+                    'item_ids[]': [item.id],
+                }, format='multipart')
+                codes.append(response.status_code)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=checkout, args=(n,)) for n in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(sorted(codes), [201] + [400] * (self.threads - 1))
+        self.assertEqual(ActiveLoan.objects.filter(item=item).count(), 1)
+        self.assertEqual(Transaction.objects.filter(items=item).count(), 1)
+
+
+class OverdueReportTests(TestCase):
+    """Reports flag loans the sweep has marked 'overdue'."""
+
+    loan_status = 'overdue'
+
+    def setUp(self):
+        self.manager = CustomUser.objects.create_user('manager', password='x', role='user_web')
+        self.item = Item.objects.create(item_name='Tripod', manager=self.manager)
+        borrower = Borrower.objects.create(name='Borrower', school_id='1000')
+        self.loan, = make_loans(self.manager, [self.item], borrower, 1, status=self.loan_status)
+        self.client = APIClient()
+        self.client.force_authenticate(self.manager)
+
+    def test_damaged_overdue_report(self):
+        response = self.client.post('/api/reports/damaged-lost-items/', {'status': 'overdue'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        row, = response.data
+        self.assertEqual(row['issue'], 'Overdue')
+        self.assertEqual(row['daysPastDue'], 7)
+
+    def test_transaction_report(self):
+        response = self.client.post('/api/reports/transactions/', {'condition': 'overdue'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        row, = response.data
+        self.assertEqual(row['id'], self.loan.id)
+        self.assertEqual(row['daysPastDue'], 7)
+
+    def test_inventory_summary(self):
+        response = self.client.get('/api/inventory/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['overdueTransactions'], 1)
+        self.assertEqual(response.data['nonOverdueBorrowedTransactions'], 0)
+
+
+class UnsweptOverdueReportTests(OverdueReportTests):
+    """Past-due loans still 'borrowed' (no sweep has run) count as overdue too."""
+
+    loan_status = 'borrowed'
+
+
+class CheckoutScopeTests(TestCase):
+    """A checkout only resolves items of the caller's manager."""
+
+    def test_mobile_user_without_manager_cannot_borrow_a_managers_item(self):
+        manager = CustomUser.objects.create_user('manager', password='x', role='user_web')
+        item = Item.objects.create(item_name='Projector', manager=manager)
+        unassigned = CustomUser.objects.create_user('scanner', password='x', role='user_mobile')
+        client = APIClient()
+        client.force_authenticate(unassigned)
+
+        response = client.post('/api/borrowing/create/', {
+            'school_id': '3000',
+            'name': 'Borrower',
+            'status': 'active',
+            'return_date': (date.today() + timedelta(days=3)).isoformat(),
+            'item_ids[]': [item.id],
+        }, format='multipart')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Transaction.objects.exists())
+        self.assertFalse(ActiveLoan.objects.exists())
+
+
+class WriteTimeOverdueTests(TestCase):
+    """Loans written with a past return date are 'overdue' without waiting for the sweep."""
+
+    def setUp(self):
+        self.manager = CustomUser.objects.create_user('manager', password='x', role='user_web')
+        self.item = Item.objects.create(item_name='Microphone', manager=self.manager)
+        self.client = APIClient()
+        self.client.force_authenticate(self.manager)
+
+    def test_back_dating_the_return_date_marks_the_loan_overdue(self):
+        borrower = Borrower.objects.create(name='Borrower', school_id='4000')
+        loan, = make_loans(self.manager, [self.item], borrower, 1, borrow_date=date.today() - timedelta(days=5))
+        loan.return_date = date.today() + timedelta(days=2)
+        loan.save()
+
+        response = self.client.patch(f'/api/transactions/{loan.id}/', {
+            'return_date': (date.today() - timedelta(days=1)).isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        loan.refresh_from_db()
+        self.assertEqual(loan.status, 'overdue')
+
+        # extending it again puts it back among the borrowed loans
+        self.client.patch(f'/api/transactions/{loan.id}/', {
+            'return_date': (date.today() + timedelta(days=1)).isoformat(),
+        }, format='json')
+        loan.refresh_from_db()
+        self.assertEqual(loan.status, 'borrowed')
+
+    def test_checkout_with_a_past_return_date_is_overdue(self):
+        response = self.client.post('/api/borrowing/create/', {
+            'school_id': '4001',
+            'name': 'Borrower',
+            'status': 'active',
+            'return_date': (date.today() - timedelta(days=1)).isoformat(),
+            'item_ids[]': [self.item.id],
+        }, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['status'], 'overdue')
+
+
+@override_settings(IMAGE_PROCESSING_TIMEOUT=600, IMAGE_PROCESSING_MAX_ATTEMPTS=3)
+class StuckItemImageTests(TestCase):
+    """Items whose background-removal job was lost do not stay 'processing'."""
+
+    def setUp(self):
+        self.manager = CustomUser.objects.create_user('manager', password='x', role='user_web')
+
+    def item(self, name, queued_minutes_ago, attempts):
+        queued_at = dj_timezone.now() - timedelta(minutes=queued_minutes_ago) if queued_minutes_ago is not None else None
+        return Item.objects.create(item_name=name, manager=self.manager, image_status='processing',
+                                   image_queued_at=queued_at, image_attempts=attempts)
+
+    def test_requeues_lost_jobs_and_gives_up_after_max_attempts(self):
+        running = self.item('running', 1, 1)
+        lost = self.item('lost', 30, 1)
+        legacy = self.item('legacy', None, 0)  # stuck before queue times were recorded
+        hopeless = self.item('hopeless', 30, 3)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(requeue_stuck_item_images(), (2, 1))
+        self.assertEqual(len(callbacks), 2)
+
+        for item in (running, lost, legacy, hopeless):
+            item.refresh_from_db()
+        self.assertEqual((running.image_status, running.image_attempts), ('processing', 1))
+        self.assertEqual((lost.image_status, lost.image_attempts), ('processing', 2))
+        self.assertEqual((legacy.image_status, legacy.image_attempts), ('processing', 1))
+        self.assertGreater(lost.image_queued_at, dj_timezone.now() - timedelta(minutes=1))
+        self.assertEqual(hopeless.image_status, 'failed')
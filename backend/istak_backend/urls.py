@@ -25,6 +25,7 @@ urlpatterns = [
     path('api/items/by-id/<int:item_id>/', views.item_by_id, name='item-by-id'),
     path('api/managers/', views.manager_list, name='manager-list'),
     path('api/borrowing/create/', views.borrowing_create, name='borrowing-create'),
+    path('api/borrowing/bulk_create/', views.borrowing_bulk_create, name='borrowing-bulk-create'),
     path('api/user/', views.UserAPIView.as_view(), name='user-detail'),
     path('api/transactions/', views.TransactionListAPIView.as_view(), name='transaction-list'),
     path('api/update_fcm_token/', views.update_fcm_token, name='update_fcm_token'),
@@ -32,11 +33,14 @@ urlpatterns = [
     path('api/analytics/transactions/', views.AnalyticsTransactionsView.as_view(), name='analytics-transactions'),
     path('api/analytics/monthly-transactions/', views.MonthlyTransactionsView.as_view(), name='monthly-transactions'),
     path('api/update_overdue_transactions/', views.update_overdue_transactions, name='update_overdue_transactions'),
+    path('api/notifications/outbox/', views.notification_outbox_stats, name='notification_outbox_stats'),
     path('api/item-status-count/', views.ItemStatusCountView.as_view(), name='item-status-count'),
     path('api/borrowers/', views.BorrowerListView.as_view(), name='borrower-list'),
     path('api/borrowers/<int:borrower_id>/transactions/', views.BorrowerTransactionsView.as_view(), name='borrower-transactions'),
     path('api/items/<str:itemId>/borrower/', views.item_borrower_view, name='item_borrower'),
+    path('api/items/<str:item_id>/image_status/', views.item_image_status, name='item_image_status'),
     path('api/return_item/', views.return_item, name='return_item'),
+    path('api/return_item/all/', views.return_all_items, name='return_all_items'),
     path('api/inventory/', views.InventorySummaryView.as_view(), name='inventory'),
     path('api/process_image/', views.ProcessImageView.as_view(), name='process_image'),
      path('api/forecast/top-items/', views.forecast_top_items_excel, name='forecast_top_items'),
@@ -15,9 +15,6 @@ from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.views import APIView
 from django.contrib import messages
-from io import BytesIO
-from PIL import Image
-from rembg import remove
 from django.core.files.base import ContentFile
 from datetime import date
 from django.db.models import Count
@@ -205,37 +202,42 @@ def item_list(request):
     return Response({'error': 'Method not allowed'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
 from django.db.models import Prefetch
+from .imaging import schedule_item_image
+from .pagination import IdPagination, TransactionPagination
+
+MAX_ITEM_HISTORY = 50
+# The mobile item list derives borrowed/available from the latest loan in
+# `transactions`, so one is embedded unless the client asks for more (or ?history=0)
+DEFAULT_ITEM_HISTORY = 1
+
+
+def _item_history_limit(request):
+    """Parse the ?history=N parameter (None, i.e. no `transactions` field, for 0)."""
+    try:
+        history = int(request.query_params.get('history', DEFAULT_ITEM_HISTORY))
+    except (TypeError, ValueError):
+        history = DEFAULT_ITEM_HISTORY
+    return min(history, MAX_ITEM_HISTORY) if history > 0 else None
+
 
 class ItemListCreateAPIView(generics.ListCreateAPIView):
     serializer_class = ItemSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = IdPagination
 
     def get_queryset(self):
         queryset = Item.objects.filter(manager=self.request.user) if self.request.user.role == 'user_web' else \
                    Item.objects.filter(manager=self.request.user.manager) if self.request.user.manager else \
                    Item.objects.none()
-        return queryset.prefetch_related(
-            Prefetch('transactions', queryset=Transaction.objects.filter(status='borrowed'), to_attr='borrowed_transactions')
-        )
+        return ItemSerializer.with_list_annotations(queryset, history=_item_history_limit(self.request))
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['history'] = _item_history_limit(self.request)
+        return context
 
     def perform_create(self, serializer):
         image_file = self.request.FILES.get('image')
-        new_image = None
-        if image_file:
-            try:
-                input_img = Image.open(image_file).convert("RGBA")
-                output_img = remove(input_img)
-                temp_buffer = BytesIO()
-                output_img.save(temp_buffer, format="PNG")
-                temp_buffer.seek(0)
-                new_image = ContentFile(
-                    temp_buffer.read(),
-                    name=f"{image_file.name.rsplit('.', 1)[0]}.png"
-                )
-            except Exception as e:
-                logger.error(f"Error removing background for new item: {str(e)}")
-                print(f"❌ Error removing background for new item: {str(e)}")
-                raise
 
         if self.request.user.role == 'user_web':
             manager = self.request.user
@@ -243,14 +245,16 @@ class ItemListCreateAPIView(generics.ListCreateAPIView):
             manager = self.request.user.manager
 
         kwargs = {'manager': manager}
-        if new_image:
-            kwargs['image'] = new_image
+        if image_file:
+            # Store the upload now; background removal runs off the request path
+            kwargs['image'] = image_file
+            kwargs['image_status'] = 'processing'
 
         instance = serializer.save(**kwargs)
 
-        if new_image:
-            logger.info(f"Background removed for item {instance.id}")
-            print(f"✅ Background removed successfully for item {instance.id}")
+        if image_file:
+            schedule_item_image(instance.id)
+            logger.info(f"Background removal queued for item {instance.id}")
 
 
 
@@ -263,36 +267,32 @@ class ItemRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView):
 
     def get_queryset(self):
         if self.request.user.role == 'user_web':
-            return Item.objects.filter(manager=self.request.user)
+            queryset = Item.objects.filter(manager=self.request.user)
         elif self.request.user.manager:
-            return Item.objects.filter(manager=self.request.user.manager)
-        return Item.objects.none()
+            queryset = Item.objects.filter(manager=self.request.user.manager)
+        else:
+            queryset = Item.objects.none()
+        return ItemSerializer.with_list_annotations(queryset, history=_item_history_limit(self.request))
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['history'] = _item_history_limit(self.request)
+        return context
 
     def perform_update(self, serializer):
         instance = serializer.instance
         image_file = self.request.FILES.get('image')
 
         if image_file:
-            try:
-                input_img = Image.open(image_file).convert("RGBA")
-                output_img = remove(input_img)
-                temp_buffer = BytesIO()
-                output_img.save(temp_buffer, format="PNG")
-                temp_buffer.seek(0)
-                new_image = ContentFile(
-                    temp_buffer.read(),
-                    name=f"{image_file.name.rsplit('.', 1)[0]}.png"
-                )
-                serializer.save(image=new_image)
-                logger.info(f"Background removed for item {instance.id}")
-                print(f"✅ Background removed successfully for item {instance.id}")
-            except Exception as e:
-                logger.error(f"Error removing background for item {instance.id}: {str(e)}")
-                print(f"❌ Error removing background for item {instance.id}: {str(e)}")
-                raise
+            serializer.save(image=image_file, image_status='processing')
+            schedule_item_image(instance.id)
+            logger.info(f"Background removal queued for item {instance.id}")
         else:
             serializer.save()
 
+        if 'condition' in serializer.validated_data:
+            mark_predictions_dirty([instance.id])
+
     def perform_destroy(self, instance):
         if instance.transactions.exists():
             # Better: Return Response directly (avoids exception handling altogether)
@@ -407,8 +407,11 @@ from rest_framework.permissions import IsAuthenticated
 from django.db import transaction as db_transaction
 from django.db.models import Count
 from uuid import UUID
-from istak_backend.models import Item, Borrower, Transaction
-from .serializers import CreateBorrowingSerializer, TransactionSerializer
+from istak_backend.models import ActiveLoan, Item, Borrower, Transaction
+from .serializers import BulkCheckoutEntrySerializer, CreateBorrowingSerializer, TransactionSerializer
+from .imaging import schedule_renditions
+from .analytics import mark_predictions_dirty, record_checkout, record_checkouts, record_transition
+from .reminders import schedule_due_reminders
 
 logger = logging.getLogger(__name__)
 # views.py
@@ -443,20 +446,6 @@ def borrowing_create(request):
             return Response({"error": "All fields (school_id, name, status, return_date) are required"}, 
                            status=status.HTTP_400_BAD_REQUEST)
 
-        # Pass data and files to serializer
-        serializer = CreateBorrowingSerializer(data=data, context={'request': request})
-        if not serializer.is_valid():
-            logger.error(f"Validation errors: {serializer.errors}")
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-
-        validated = serializer.validated_data
-        school_id = validated['school_id']
-        name = validated['name']
-        status_choice = validated['status']
-        image_file = request.FILES.get('image')
-        return_date = validated['return_date']
-        item_ids = validated['item_ids']
-
         # Role check - already allows both user_mobile and user_web
         if request.user.role not in ['user_mobile', 'user_web']:
             return Response({"error": "Invalid user role"}, status=status.HTTP_403_FORBIDDEN)
@@ -464,21 +453,54 @@ def borrowing_create(request):
         # Resolve manager context
         manager = request.user if request.user.role == 'user_web' else request.user.manager
 
-        # Fetch items
-        items = Item.objects.filter(id__in=item_ids, manager=manager)
-        found_ids = list(items.values_list('id', flat=True))
+        # Lock the requested items, check them and create the transaction in one
+        # DB transaction so two scanners can never lend the same item twice.
+        with db_transaction.atomic():
+            # The serializer resolves (and row-locks, in a stable order to avoid
+            # deadlocks) the manager's items in a single query
+            serializer = CreateBorrowingSerializer(data=data, context={
+                'request': request,
+                'manager': manager,
+                'items_queryset': Item.objects.select_for_update().order_by('id'),
+            })
+            if not serializer.is_valid():
+                logger.error(f"Validation errors: {serializer.errors}")
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+            validated = serializer.validated_data
+            school_id = validated['school_id']
+            name = validated['name']
+            status_choice = validated['status']
+            image_file = request.FILES.get('image')
+            return_date = validated['return_date']
+            items = validated['items']
+            found_ids = validated['item_ids']
+
+            # Check for duplicate transaction (e.g. a replayed offline checkout)
+            existing_transaction = Transaction.objects.filter(
+                borrower__school_id=school_id,
+                borrow_date=date.today(),
+                return_date=return_date,
+                status__in=('borrowed', 'overdue'),
+                manager=manager,
+            ).select_related('borrower').prefetch_related('items').first()
 
-        if len(found_ids) != len(item_ids):
-            missing = set(item_ids) - set(found_ids)
-            logger.error(f"Items not found: {missing}")
-            return Response({"error": f"Items not found: {missing}"}, status=status.HTTP_400_BAD_REQUEST)
+            if existing_transaction:
+                existing_item_ids = {item.id for item in existing_transaction.items.all()}
+                if existing_item_ids == set(found_ids):
+                    # Duplicate found - return existing transaction data
+                    response_serializer = TransactionSerializer(existing_transaction, context={'request': request})
+                    logger.info(f"Duplicate transaction detected and skipped: {existing_transaction.id}")
+                    return Response(response_serializer.data, status=status.HTTP_201_CREATED)
 
-        unavailable = [item.id for item in items if item.transactions.filter(status='borrowed').exists()]
-        if unavailable:
-            return Response({"error": f"Items already borrowed: {unavailable}"}, status=status.HTTP_400_BAD_REQUEST)
+            # Availability of the whole cart in one primary-key lookup
+            unavailable = list(
+                ActiveLoan.objects.filter(item_id__in=found_ids).values_list('item_id', flat=True)
+            )
+            if unavailable:
+                return Response({"error": f"Items already borrowed: {unavailable}"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Create borrower + transaction
-        with db_transaction.atomic():
+            # Create borrower + transaction
             borrower, created = Borrower.objects.get_or_create(
                 school_id=school_id,
                 defaults={'name': name, 'status': status_choice}
@@ -490,36 +512,28 @@ def borrowing_create(request):
                 orig_name = getattr(image_file, 'name', 'upload')
                 filename = f"{school_id}_{timestamp}_{orig_name}"
                 borrower.image.save(filename, ContentFile(image_file.read()), save=False)
+                schedule_renditions(borrower)
             borrower.save()
 
-            # Check for duplicate transaction
-            existing_transaction = Transaction.objects.filter(
-                borrower=borrower,
-                borrow_date=date.today(),
-                return_date=return_date,
-                status='borrowed',
-                manager=manager,
-            ).select_related('borrower').prefetch_related('items').first()
-
-            if existing_transaction:
-                existing_item_ids = set(existing_transaction.items.values_list('id', flat=True))
-                if existing_item_ids == set(item_ids):
-                    # Duplicate found - return existing transaction data
-                    response_serializer = TransactionSerializer(existing_transaction, context={'request': request})
-                    logger.info(f"Duplicate transaction detected and skipped: {existing_transaction.id}")
-                    return Response(response_serializer.data, status=status.HTTP_201_CREATED)
-
             # No duplicate - create new transaction
             transaction = Transaction.objects.create(
                 borrower=borrower,
                 borrow_date=date.today(),
                 return_date=return_date,
-                status='borrowed',
+                status=Transaction.open_status(return_date),
                 manager=manager,
                 mobile_user=request.user if request.user.role == 'user_mobile' else None,
             )
-            transaction.items.set(items)
-
+            Transaction.items.through.objects.bulk_create([
+                Transaction.items.through(transaction_id=transaction.id, item_id=item_id)
+                for item_id in found_ids
+            ])
+            ActiveLoan.open_for(transaction, found_ids)
+            record_checkout(transaction, found_ids)
+            mark_predictions_dirty(found_ids)
+            schedule_due_reminders([transaction])
+
+            transaction.cart_items = items
             response_serializer = TransactionSerializer(transaction, context={'request': request})  # Pass context
             logger.info(f"Transaction created: {transaction.id}")
             return Response(response_serializer.data, status=status.HTTP_201_CREATED)
@@ -528,6 +542,160 @@ def borrowing_create(request):
         logger.exception("Error creating borrowing")
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
+MAX_BULK_CHECKOUTS = 200
+
+
+@api_view(['POST'])
+@authentication_classes([JWTAuthentication])
+@permission_classes([IsAuthenticated])
+def borrowing_bulk_create(request):
+    """
+    Create many checkouts in one request (e.g. replaying an offline queue).
+    Body: {"checkouts": [{school_id, name, status, return_date, item_ids}, ...]}
+    Items, borrowers and availability are resolved with set-based queries
+    and everything is written with bulk_create, so the number of queries
+    does not grow with the batch. Returns one result per entry, in order.
+    """
+    try:
+        if request.user.role not in ['user_mobile', 'user_web']:
+            return Response({"error": "Invalid user role"}, status=status.HTTP_403_FORBIDDEN)
+
+        manager = request.user if request.user.role == 'user_web' else request.user.manager
+        if not manager:
+            return Response({"error": "No manager assigned for mobile user"}, status=status.HTTP_403_FORBIDDEN)
+
+        entries = request.data.get('checkouts') if isinstance(request.data, dict) else request.data
+        if not isinstance(entries, list) or not entries:
+            return Response({"error": "checkouts must be a non-empty list"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(entries) > MAX_BULK_CHECKOUTS:
+            return Response({"error": f"At most {MAX_BULK_CHECKOUTS} checkouts per request"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        results = [None] * len(entries)
+        valid = []  # (index, validated data)
+        for index, entry in enumerate(entries):
+            serializer = BulkCheckoutEntrySerializer(data=entry)
+            if serializer.is_valid():
+                valid.append((index, serializer.validated_data))
+            else:
+                results[index] = {"index": index, "status": "error", "error": serializer.errors}
+
+        today = date.today()
+        mobile_user = request.user if request.user.role == 'user_mobile' else None
+
+        with db_transaction.atomic():
+            requested_ids = {iid for _, data in valid for iid in data['item_ids']}
+            found_ids = set(
+                Item.objects.select_for_update()
+                .filter(id__in=requested_ids, manager=manager)
+                .order_by('id')
+                .values_list('id', flat=True)
+            )
+            lent_ids = set(
+                ActiveLoan.objects.filter(item_id__in=found_ids).values_list('item_id', flat=True)
+            )
+
+            # Open loans created today, to make replays of the same checkout idempotent
+            school_ids = {data['school_id'] for _, data in valid}
+            existing = {}
+            for tx in Transaction.objects.filter(
+                borrower__school_id__in=school_ids,
+                borrow_date=today,
+                status__in=('borrowed', 'overdue'),
+                manager=manager,
+            ).select_related('borrower').prefetch_related('items'):
+                key = (tx.borrower.school_id, tx.return_date, frozenset(i.id for i in tx.items.all()))
+                existing[key] = tx.id
+
+            accepted = []  # (index, data)
+            for index, data in valid:
+                item_ids = data['item_ids']
+                key = (data['school_id'], data['return_date'], frozenset(item_ids))
+                missing = set(item_ids) - found_ids
+                if key in existing:
+                    results[index] = {"index": index, "status": "duplicate", "transaction_id": existing[key]}
+                elif missing or len(set(item_ids)) != len(item_ids):
+                    results[index] = {"index": index, "status": "error",
+                                      "error": f"Items not found: {sorted(missing) or item_ids}"}
+                elif lent_ids & set(item_ids):
+                    results[index] = {"index": index, "status": "error",
+                                      "error": f"Items already borrowed: {sorted(lent_ids & set(item_ids))}"}
+                else:
+                    lent_ids.update(item_ids)  # later entries in the batch can't reuse them
+                    accepted.append((index, data))
+
+            if accepted:
+                # Borrowers: fetch, create the missing ones, refresh names/statuses
+                latest = {data['school_id']: data for _, data in accepted}
+                borrowers = Borrower.objects.in_bulk(list(latest), field_name='school_id')
+                new_ids = [sid for sid in latest if sid not in borrowers]
+                if new_ids:
+                    Borrower.objects.bulk_create(
+                        [Borrower(school_id=sid, name=latest[sid]['name'], status=latest[sid]['status'])
+                         for sid in new_ids],
+                        ignore_conflicts=True,
+                    )
+                    borrowers.update(Borrower.objects.in_bulk(new_ids, field_name='school_id'))
+                for sid, data in latest.items():
+                    borrowers[sid].name = data['name']
+                    borrowers[sid].status = data['status']
+                Borrower.objects.bulk_update(list(borrowers.values()), ['name', 'status'])
+
+                transactions = Transaction.objects.bulk_create([
+                    Transaction(
+                        borrower=borrowers[data['school_id']],
+                        borrow_date=today,
+                        return_date=data['return_date'],
+                        status=Transaction.open_status(data['return_date']),
+                        manager=manager,
+                        mobile_user=mobile_user,
+                    )
+                    for _, data in accepted
+                ])
+                Transaction.items.through.objects.bulk_create([
+                    Transaction.items.through(transaction_id=tx.id, item_id=item_id)
+                    for tx, (_, data) in zip(transactions, accepted)
+                    for item_id in data['item_ids']
+                ])
+                ActiveLoan.objects.bulk_create([
+                    ActiveLoan(item_id=item_id, transaction_id=tx.id, manager=manager)
+                    for tx, (_, data) in zip(transactions, accepted)
+                    for item_id in data['item_ids']
+                ])
+                record_checkouts([
+                    (tx, data['item_ids']) for tx, (_, data) in zip(transactions, accepted)
+                ])
+                mark_predictions_dirty([iid for _, data in accepted for iid in data['item_ids']])
+                schedule_due_reminders(transactions)
+
+                for tx, (index, _) in zip(transactions, accepted):
+                    results[index] = {"index": index, "status": "created", "transaction_id": tx.id}
+
+        created = sum(1 for r in results if r["status"] == "created")
+        logger.info(f"Bulk checkout by {request.user.username}: {created}/{len(entries)} created")
+        return Response({"created": created, "results": results}, status=status.HTTP_200_OK)
+
+    except Exception as e:
+        logger.exception("Error creating bulk borrowing")
+        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['GET'])
+@authentication_classes([JWTAuthentication])
+@permission_classes([IsAuthenticated])
+def item_image_status(request, item_id):
+    """Poll target for uploads: 'processing' until background removal finishes."""
+    manager = request.user if request.user.role == 'user_web' else request.user.manager
+    item = Item.objects.filter(id=item_id, manager=manager).only('id', 'image', 'image_status').first()
+    if not item:
+        return Response({"error": "Item not found"}, status=status.HTTP_404_NOT_FOUND)
+    return Response({
+        "id": item.id,
+        "image_status": item.image_status,
+        "image": request.build_absolute_uri(item.image.url) if item.image else None,
+    }, status=status.HTTP_200_OK)
+
+
 @api_view(['GET'])
 @authentication_classes([JWTAuthentication])
 @permission_classes([IsAuthenticated])
@@ -571,6 +739,7 @@ class TransactionListAPIView(generics.ListAPIView):
     serializer_class = TransactionSerializer
     permission_classes = [IsAuthenticated]
     authentication_classes = [JWTAuthentication]
+    pagination_class = TransactionPagination
 
     def get_queryset(self):
         user = self.request.user
@@ -604,7 +773,9 @@ class TransactionDeleteAPIView(generics.DestroyAPIView):
 
     def perform_destroy(self, instance):
         logger.info(f"Deleting transaction {instance.id} by user {self.request.user.username}")
-        instance.delete()
+        with db_transaction.atomic():
+            record_transition(Transaction.objects.filter(pk=instance.pk), instance.status, None)
+            instance.delete()
 
 @api_view(['POST'])
 @authentication_classes([JWTAuthentication])
@@ -649,6 +820,7 @@ from .models import Transaction
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 from rest_framework.permissions import AllowAny
+from .analytics import monthly_status_counts
 import logging  # FIXED: Added for debugging
 
 logger = logging.getLogger(__name__)
@@ -661,9 +833,9 @@ class MonthlyTransactionsView(APIView):
             # Calculate the date range: last 6 months + current = 7 months
             today = dj_timezone.now().date()
             start_date = today - relativedelta(months=6)  # Starts from 7 months ago
-            transactions = Transaction.objects.filter(borrow_date__gte=start_date)
+            rollup_counts = monthly_status_counts(start_date)
 
-            logger.info(f"Fetching transactions from {start_date} to {today}. Found {transactions.count()} total.")
+            logger.info(f"Fetching rollups from {start_date} to {today}. Found {len(rollup_counts)} months.")
 
             # Initialize monthly data for exactly 7 months (with zeros for empty)
             monthly_data = {}
@@ -673,14 +845,10 @@ class MonthlyTransactionsView(APIView):
                 monthly_data[month_key] = {'borrowed': 0, 'returned': 0}
                 current_date += relativedelta(months=1)
 
-            # Aggregate transactions - FIXED: Ensure borrow_date is used correctly
-            for t in transactions:
-                month_key = t.borrow_date.strftime('%Y-%m')
+            # Fill in the months that have loans (already aggregated by the rollups)
+            for month_key, counts in rollup_counts.items():
                 if month_key in monthly_data:
-                    if t.status.lower() == 'borrowed':
-                        monthly_data[month_key]['borrowed'] += 1
-                    elif t.status.lower() == 'returned':
-                        monthly_data[month_key]['returned'] += 1
+                    monthly_data[month_key] = counts
 
             logger.info(f"Aggregated data: {monthly_data}")  # FIXED: Added logging to debug empty months
 
@@ -713,36 +881,56 @@ class MonthlyTransactionsView(APIView):
 @authentication_classes([JWTAuthentication])
 @permission_classes([IsAuthenticated])
 def update_overdue_transactions(request):
+    """
+    Overdue status is maintained by the scheduled sweep_overdue_transactions
+    task; this endpoint only runs its incremental pass on demand (cheap when
+    the sweep is current) for clients that still call it.
+    """
+    from .tasks import sweep_overdue_transactions  # keep celery/firebase out of module import
     try:
-        today = date.today()
-        # Find borrowed transactions with past due return dates
-        overdue_transactions = Transaction.objects.filter(
-            status='borrowed',
-            return_date__lt=today
-        )
-        count = overdue_transactions.count()
-        overdue_transactions.update(status='overdue')
+        count = sweep_overdue_transactions()
         return Response({
             "status": "success",
             "message": f"Updated {count} transactions to overdue status"
         }, status=status.HTTP_200_OK)
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+from .outbox import stats as outbox_stats
+
+
+@api_view(['GET'])
+@authentication_classes([JWTAuthentication])
+@permission_classes([IsAuthenticated])
+def notification_outbox_stats(request):
+    """Push outbox health: queue depth, retries, oldest pending age and delivery latency."""
+    if request.user.role != 'user_web':
+        return Response({"error": "Only managers can view notification stats"}, status=status.HTTP_403_FORBIDDEN)
+    try:
+        return Response(outbox_stats(), status=status.HTTP_200_OK)
+    except Exception as e:
+        logger.error(f"Error reading outbox stats: {str(e)}")
+        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
     
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from .models import Item, Transaction
+from .models import ActiveLoan, Item, Transaction
+from .analytics import resolve_manager
 
 class ItemStatusCountView(APIView):
     def get(self, request):
         try:
-            # Count items based on current_transaction status
-            total_items = Item.objects.count()
-            borrowed_items = Item.objects.filter(
-                current_transaction__status='borrowed'
-            ).count()
+            manager = resolve_manager(request.user)
+            if manager is None:
+                return Response({"error": "Unauthorized role or missing manager."},
+                                status=status.HTTP_403_FORBIDDEN)
+
+            # Lent-out items are exactly the manager's active loans
+            total_items = Item.objects.filter(manager=manager).count()
+            borrowed_items = ActiveLoan.objects.filter(manager=manager).count()
             available_items = total_items - borrowed_items
 
             return Response({
@@ -759,14 +947,16 @@ from rest_framework.response import Response
 from rest_framework import status
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework.permissions import IsAuthenticated
-from django.db.models import Count, Max, Q
-from .models import Borrower
+from django.db.models import Count, Q
+from .models import Borrower, Transaction
 from .serializers import BorrowerSerializer
+from .pagination import IdPagination, TransactionPagination
 import logging
 
 logger = logging.getLogger(__name__)
 
-from django.db.models import Max, Q
+from django.db.models import Q
+from rest_framework.exceptions import APIException
 
 class BorrowerListView(APIView):
     permission_classes = [IsAuthenticated]
@@ -786,34 +976,34 @@ class BorrowerListView(APIView):
 
             # Scope queryset based on role
             if request.user.role == 'user_mobile':
-                borrowers = Borrower.objects.filter(
-                    transactions__mobile_user=request.user
-                )
+                scope = {'mobile_user': request.user}
             else:  # user_web
-                borrowers = Borrower.objects.filter(
-                    transactions__manager=request.user
-                )
+                scope = {'manager': request.user}
 
-            # Annotate with total borrowed items and current borrow date
-            borrowers = borrowers.distinct().annotate(
-                total_borrowed_items=Count(
-                    'transactions__items',
-                    filter=Q(transactions__status='borrowed')
-                ),
-                current_borrow_date=Max(
-                    'transactions__borrow_date',
-                    filter=Q(transactions__status='borrowed')
-                )
+            # Per-borrower counts, dates and active items are precomputed
+            # (3 queries total) so the serializer never queries per row
+            borrower_ids = Transaction.objects.filter(**scope).values('borrower_id')
+            borrowers = BorrowerSerializer.with_list_annotations(
+                Borrower.objects.filter(id__in=borrower_ids), **scope
             )
 
+            paginator = IdPagination()
+            page = paginator.paginate_queryset(borrowers, request, view=self)
+            serializer = BorrowerSerializer(
+                borrowers if page is None else page, many=True, context={'request': request}
+            )
+            data = serializer.data
+
             logger.info(
                 f"User: {request.user.username}, Role: {request.user.role}, "
-                f"Borrowers found: {borrowers.count()}"
+                f"Borrowers found: {len(data)}"
             )
+            if page is not None:
+                return paginator.get_paginated_response(data)
+            return Response(data, status=status.HTTP_200_OK)
 
-            serializer = BorrowerSerializer(borrowers, many=True, context={'request': request})
-            return Response(serializer.data, status=status.HTTP_200_OK)
-
+        except APIException:
+            raise  # e.g. a bad pagination cursor: DRF answers with its 4xx
         except Exception as e:
             logger.exception(f"Error fetching borrowers for user {request.user.username}")
             return Response(
@@ -840,11 +1030,19 @@ class BorrowerTransactionsView(APIView):
                 borrower_id=borrower_id,
                 mobile_user=request.user
             ).select_related('borrower').prefetch_related('items').order_by('-borrow_date')
-            
+
+            paginator = TransactionPagination()
+            page = paginator.paginate_queryset(transactions, request, view=self)
+            if page is not None:
+                serializer = TransactionSerializer(page, many=True, context={'request': request})
+                return paginator.get_paginated_response(serializer.data)
+
             serializer = TransactionSerializer(transactions, many=True, context={'request': request})
             return Response(serializer.data, status=status.HTTP_200_OK)
         except Borrower.DoesNotExist:
             return Response({"error": "Borrower not found"}, status=status.HTTP_404_NOT_FOUND)
+        except APIException:
+            raise  # e.g. a bad pagination cursor: DRF answers with its 4xx
         except Exception as e:
             return Response({"error": f"Failed to fetch transactions: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -855,7 +1053,7 @@ from rest_framework import status
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework.permissions import IsAuthenticated
 from django.db import transaction as db_transaction
-from istak_backend.models import Item, Borrower, Transaction
+from istak_backend.models import ActiveLoan, Item, Borrower, Transaction
 from istak_backend.serializers import BorrowerSerializer
 import logging
 
@@ -875,24 +1073,23 @@ def item_borrower_view(request, itemId):
             logger.error(f"No manager assigned for user {request.user.username}")
             return Response({"error": "No manager assigned for mobile user"}, status=status.HTTP_403_FORBIDDEN)
 
-        # Find the item with id explicitly selected
-        try:
-            item = Item.objects.only('id', 'manager').get(id=itemId, manager=manager)
-            logger.info(f"Found item {itemId} managed by {manager.username}")
-        except Item.DoesNotExist:
-            logger.error(f"Item {itemId} not found or not managed by {manager.username}")
-            return Response({"error": f"Item {itemId} not found or not managed by your manager"}, status=status.HTTP_404_NOT_FOUND)
-
-        # Find the active transaction for this item with borrower fields loaded
-        transaction = Transaction.objects.select_related('borrower').prefetch_related('items').filter(
-            items=item,
-            status='borrowed',
-            manager=manager
-        ).first()
-        if not transaction:
+        # Find the item and its active loan (primary-key lookups)
+        loan = (
+            ActiveLoan.objects.select_related('item', 'transaction__borrower')
+            .prefetch_related('transaction__items')
+            .filter(item_id=itemId, item__manager=manager)
+            .first()
+        )
+        if not loan:
+            if not Item.objects.filter(id=itemId, manager=manager).exists():
+                logger.error(f"Item {itemId} not found or not managed by {manager.username}")
+                return Response({"error": f"Item {itemId} not found or not managed by your manager"}, status=status.HTTP_404_NOT_FOUND)
             logger.error(f"No active borrowed transaction for item {itemId}")
             return Response({"error": f"Item {itemId} is not currently borrowed"}, status=status.HTTP_400_BAD_REQUEST)
 
+        logger.info(f"Found item {itemId} managed by {manager.username}")
+        transaction = loan.transaction
+
         # Get all items in this transaction
         borrowed_items = [
             {
@@ -928,12 +1125,10 @@ from rest_framework.response import Response
 from rest_framework import status
 from django.db.models import Count
 
-from .models import Item, Transaction, Borrower
-from PIL import Image, ImageDraw, ImageFont
+from .models import ActiveLoan, Item, Transaction, Borrower
+from .serializers import ReturnAllItemsSerializer, ReturnItemSerializer
+from .imaging import ImageRejected, prepare_image, watermark_photo
 from django.core.files.base import ContentFile
-from io import BytesIO
-import os
-from django.conf import settings
 import logging
 
 logger = logging.getLogger(__name__)
@@ -943,32 +1138,55 @@ logger = logging.getLogger(__name__)
 @permission_classes([IsAuthenticated])
 def return_item(request):
     try:
-        # Parse request data
-        school_id = request.data.get('school_id')
-        items_data = []
-        for i in range(len(request.data) // 2):  # Parse items array
-            item_id = request.data.get(f'items[{i}][itemId]') or request.data.get(f'items[{i}][item_id]')
-            condition = request.data.get(f'items[{i}][condition]')
-            if item_id and condition:
-                items_data.append({'item_id': item_id, 'condition': condition})
+        payload = ReturnItemSerializer(data=request.data)
+        if not payload.is_valid():
+            return Response(payload.errors, status=status.HTTP_400_BAD_REQUEST)
+        school_id = payload.validated_data.get('school_id')
+        conditions = {entry['item_id']: entry['condition'] for entry in payload.validated_data['items']}
 
         return_image = request.FILES.get('return_image')
-        if not items_data:
-            return Response({"error": "No items provided"}, status=status.HTTP_400_BAD_REQUEST)
-
-        # Find transaction
-        item_ids = [item['item_id'] for item in items_data]
-        transactions = Transaction.objects.filter(
-            status='borrowed',
-            items__id__in=item_ids,
-        ).annotate(num_matches=Count('items__id')).filter(num_matches=len(item_ids))
+        # Validate image size (max 5MB) and decode it before touching the database
+        if return_image and return_image.size > 5 * 1024 * 1024:
+            return Response({"error": "Return image size exceeds 5MB"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            return_photo = prepare_image(return_image) if return_image else None
+        except ImageRejected as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-        if school_id:
-            transactions = transactions.filter(borrower__school_id=school_id)
+        with db_transaction.atomic():
+            # The open loans of the returned items must all belong to one transaction
+            loans = list(
+                ActiveLoan.objects.select_for_update()
+                .filter(item_id__in=conditions)
+                .values_list('transaction_id', flat=True)
+            )
+            transaction = None
+            if len(loans) == len(conditions) and len(set(loans)) == 1:
+                transactions = Transaction.objects.select_for_update(of=('self',)).select_related('borrower').filter(
+                    pk=loans[0], status__in=['borrowed', 'overdue'],
+                )
+                if school_id:
+                    transactions = transactions.filter(borrower__school_id=school_id)
+                transaction = transactions.first()
+            if not transaction:
+                return Response({"error": "No matching borrowed transaction found"}, status=status.HTTP_400_BAD_REQUEST)
+
+            # Update transaction
+            record_transition(Transaction.objects.filter(pk=transaction.pk), transaction.status, 'returned')
+            transaction.status = 'returned'
+            transaction.return_date = dj_timezone.now().date()
+            transaction.save(update_fields=['status', 'return_date'])
+            returned_ids = list(
+                ActiveLoan.objects.filter(transaction=transaction).values_list('item_id', flat=True)
+            )
+            ActiveLoan.close_for(transaction)
 
-        transaction = transactions.first()
-        if not transaction:
-            return Response({"error": "No matching borrowed transaction found"}, status=status.HTTP_400_BAD_REQUEST)
+            # Update item conditions
+            items = list(Item.objects.filter(id__in=conditions).only('id', 'condition'))
+            for item in items:
+                item.condition = conditions[item.id]
+            Item.objects.bulk_update(items, ['condition'])
+            mark_predictions_dirty(returned_ids)
 
         # Get borrower details
         borrower = transaction.borrower
@@ -977,53 +1195,8 @@ def return_item(request):
 
         # Process return_image if provided
         processed_image = None
-        if return_image:
-            # Validate image size (max 5MB)
-            if return_image.size > 5 * 1024 * 1024:
-                return Response({"error": "Return image size exceeds 5MB"}, status=status.HTTP_400_BAD_REQUEST)
-
-            # Open and process image
-            image = Image.open(return_image).convert('RGB')
-            draw = ImageDraw.Draw(image)
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            text = f"Name: {name}\nSchool ID: {school_id}\nReturned: {timestamp}"
-
-            try:
-                font = ImageFont.truetype(os.path.join(settings.BASE_DIR, 'fonts', 'arial.ttf'), 24)
-            except IOError:
-                font = ImageFont.load_default(size=24)
-
-            text_position = (10, 10)
-            draw.multiline_text(
-                text_position,
-                text,
-                font=font,
-                fill=(255, 255, 255, 255),
-                stroke_width=2,
-                stroke_fill=(0, 0, 0, 255)
-            )
-
-            # Save processed image to buffer
-            buffer = BytesIO()
-            image.save(buffer, format="PNG")
-            buffer.seek(0)
-            timestamp_clean = timestamp.replace(":", "-").replace(" ", "_")
-            filename = f"borrower_return_image_{school_id}_{timestamp_clean}.png"
-            processed_image = ContentFile(buffer.read(), name=filename)
-
-        # Update transaction
-        transaction.status = 'returned'
-        transaction.return_date = dj_timezone.now().date()
-        transaction.save()
-
-        # Update item conditions
-        for item_data in items_data:
-            try:
-                item = Item.objects.get(id=item_data['item_id'])
-                item.condition = item_data['condition']
-                item.save()
-            except Item.DoesNotExist:
-                logger.warning(f"Item {item_data['item_id']} not found")
+        if return_photo:
+            processed_image = watermark_photo(return_photo, name, school_id, "Returned", "borrower_return_image")
 
         # Update borrower's return_image
         if processed_image:
@@ -1043,6 +1216,105 @@ def return_item(request):
     except Exception as e:
         logger.error(f"Error in return_item: {str(e)}")
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['POST'])
+@authentication_classes([JWTAuthentication])
+@permission_classes([IsAuthenticated])
+def return_all_items(request):
+    """
+    Close every open transaction of a borrower (under the caller's manager)
+    in one pass: {"school_id", "condition"?, "items"?: [{item_id, condition}]}
+    plus an optional `return_image`, which is stamped and encoded once.
+    """
+    try:
+        if request.user.role not in ['user_mobile', 'user_web']:
+            return Response({"error": "Invalid user role"}, status=status.HTTP_403_FORBIDDEN)
+        manager = request.user if request.user.role == 'user_web' else request.user.manager
+        if not manager:
+            return Response({"error": "No manager assigned for mobile user"}, status=status.HTTP_403_FORBIDDEN)
+
+        payload = ReturnAllItemsSerializer(data=request.data)
+        if not payload.is_valid():
+            return Response(payload.errors, status=status.HTTP_400_BAD_REQUEST)
+        school_id = payload.validated_data['school_id']
+        default_condition = payload.validated_data.get('condition')
+        conditions = {entry['item_id']: entry['condition'] for entry in payload.validated_data.get('items', [])}
+
+        return_image = request.FILES.get('return_image')
+        if return_image and return_image.size > 5 * 1024 * 1024:
+            return Response({"error": "Return image size exceeds 5MB"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            return_photo = prepare_image(return_image) if return_image else None
+        except ImageRejected as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        borrower = Borrower.objects.filter(school_id=school_id).first()
+        if not borrower:
+            return Response({"error": "Borrower not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        today = dj_timezone.now().date()
+        with db_transaction.atomic():
+            open_transactions = dict(
+                Transaction.objects.select_for_update()
+                .filter(borrower=borrower, manager=manager, status__in=['borrowed', 'overdue'])
+                .order_by('id')
+                .values_list('id', 'status')
+            )
+            if not open_transactions:
+                return Response({"error": "No open transactions for this borrower"}, status=status.HTTP_400_BAD_REQUEST)
+
+            item_ids = list(
+                ActiveLoan.objects.filter(transaction_id__in=open_transactions).values_list('item_id', flat=True)
+            )
+            unknown = set(conditions) - set(item_ids)
+            if unknown:
+                return Response({"error": f"Items not borrowed by {school_id}: {sorted(unknown)}"},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+            for old_status in set(open_transactions.values()):
+                record_transition(
+                    Transaction.objects.filter(
+                        pk__in=[pk for pk, s in open_transactions.items() if s == old_status]
+                    ),
+                    old_status, 'returned',
+                )
+            Transaction.objects.filter(pk__in=open_transactions).update(status='returned', return_date=today)
+            ActiveLoan.objects.filter(transaction_id__in=open_transactions).delete()
+
+            # Per-item conditions override the default; items without either keep theirs
+            items = [
+                item for item in Item.objects.filter(id__in=item_ids).only('id', 'condition')
+                if conditions.get(item.id, default_condition)
+            ]
+            for item in items:
+                item.condition = conditions.get(item.id, default_condition)
+            Item.objects.bulk_update(items, ['condition'])
+            mark_predictions_dirty(item_ids)
+
+        if return_photo:
+            borrower.return_image = watermark_photo(
+                return_photo, borrower.name, borrower.school_id, "Returned", "borrower_return_image"
+            )
+            borrower.save(update_fields=['return_image'])
+
+        logger.info(
+            f"Returned {len(open_transactions)} transactions ({len(item_ids)} items) for borrower {school_id}"
+        )
+        return Response(
+            {
+                "status": "success",
+                "message": "Items returned successfully",
+                "transaction_ids": list(open_transactions),
+                "item_ids": item_ids,
+                "image_url": request.build_absolute_uri(borrower.return_image.url) if return_photo else None,
+            },
+            status=status.HTTP_200_OK
+        )
+
+    except Exception as e:
+        logger.error(f"Error in return_all_items: {str(e)}")
+        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
 # views.py
 # views.py (Revised: Now returns transaction counts, not item counts)
@@ -1058,6 +1330,8 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+from .analytics import inventory_summary
+
 class InventorySummaryView(APIView):
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthenticated]
@@ -1070,27 +1344,20 @@ class InventorySummaryView(APIView):
             # Scope by role
             if user.role == 'user_web':
                 queryset = Transaction.objects.filter(manager=user)
-                items = Item.objects.filter(manager=user)
+                scope, manager_id = f"manager:{user.id}", user.id
             elif user.role == 'user_mobile':
                 queryset = Transaction.objects.filter(mobile_user=user)
-                items = Item.objects.filter(manager=user.manager) if user.manager else Item.objects.none()
+                scope, manager_id = f"mobile:{user.id}", user.manager_id
             else:
                 return Response({"error": "Invalid user role"}, status=status.HTTP_403_FORBIDDEN)
 
-            # Counts
-            returned_transactions = queryset.filter(status='returned').count()
-            overdue_transactions = queryset.filter(
-                Q(status='overdue') | (Q(status='borrowed') & Q(return_date__lt=today))
-            ).count()
-            non_overdue_borrowed = queryset.filter(
-                status='borrowed',
-                return_date__gte=today
-            ).count()
+            # Counts (one aggregate query, served from cache between writes)
+            counts = inventory_summary(queryset, today, scope, manager_id)
+            returned_transactions = counts['returned']
+            overdue_transactions = counts['overdue']
+            non_overdue_borrowed = counts['non_overdue_borrowed']
             borrowed_active = non_overdue_borrowed + overdue_transactions
-            returning_today_transactions = queryset.filter(
-                status='borrowed',
-                return_date=today
-            ).count()
+            returning_today_transactions = counts['returning_today']
             total_transactions = returned_transactions + borrowed_active
 
             # Log counts for debugging
@@ -1116,13 +1383,10 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
-from PIL import Image, ImageDraw, ImageFont
 from django.core.files.base import ContentFile
-from io import BytesIO
-import os
 from datetime import datetime
-from django.conf import settings
 from istak_backend.models import Borrower
+from .imaging import ImageRejected, prepare_image, schedule_renditions, watermark_photo
 
 class ProcessImageView(APIView):
     permission_classes = [IsAuthenticated]
@@ -1143,26 +1407,11 @@ class ProcessImageView(APIView):
             if len(name) > 255 or len(school_id) > 10:
                 return Response({"error": "Name or school_id exceeds maximum length"}, status=status.HTTP_400_BAD_REQUEST)
 
-            image = Image.open(image_file).convert('RGB')
-            draw = ImageDraw.Draw(image)
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            text = f"Name: {name}\nSchool ID: {school_id}\nCaptured: {timestamp}"
-
             try:
-                font = ImageFont.truetype(os.path.join(settings.BASE_DIR, 'fonts', 'arial.ttf'), 24)
-            except IOError:
-                font = ImageFont.load_default(size=24)
-
-            text_position = (10, 10)
-            draw.multiline_text(text_position, text, font=font, fill=(255, 255, 255, 255), stroke_width=2, stroke_fill=(0, 0, 0, 255))
-
-            buffer = BytesIO()
-            image.save(buffer, format="PNG")
-            buffer.seek(0)
-
-            timestamp_clean = timestamp.replace(":", "-").replace(" ", "_")
-            filename = f"borrower_image_{school_id}_{timestamp_clean}.png"
-            processed_image = ContentFile(buffer.read(), name=filename)
+                image = prepare_image(image_file)
+            except ImageRejected as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            processed_image = watermark_photo(image, name, school_id, "Captured", "borrower_image")
 
             # Create or update Borrower
             borrower, created = Borrower.objects.get_or_create(
@@ -1174,6 +1423,7 @@ class ProcessImageView(APIView):
                 borrower.image = processed_image
                 borrower.status = 'active'
                 borrower.save()
+            schedule_renditions(borrower)
 
             image_url = request.build_absolute_uri(borrower.image.url)
             return Response({"image_url": image_url}, status=status.HTTP_200_OK)
@@ -1285,6 +1535,7 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework_simplejwt.authentication import JWTAuthentication
 
 from .models import Transaction
+from .analytics import resolve_manager, scoped_rollups, still_borrowed
 
 @api_view(["GET"])
 @authentication_classes([JWTAuthentication])
@@ -1296,23 +1547,23 @@ def borrowed_stats(request):
     """
     range_type = request.query_params.get("range", "yesterday")  # default = yesterday
     today = localdate()
-    qs = Transaction.objects.filter(status="borrowed")
+    qs = scoped_rollups(resolve_manager(request.user)).filter(item__isnull=True)
 
     if range_type == "today":
-        qs = qs.filter(borrow_date=today)
+        qs = qs.filter(day=today)
 
     elif range_type == "yesterday":
-        qs = qs.filter(borrow_date=today - timedelta(days=1))
+        qs = qs.filter(day=today - timedelta(days=1))
 
     elif range_type == "week":
         start_of_week = today - timedelta(days=today.weekday())  # Monday
-        qs = qs.filter(borrow_date__gte=start_of_week, borrow_date__lte=today)
+        qs = qs.filter(day__gte=start_of_week, day__lte=today)
 
     elif range_type == "month":
         start_of_month = today.replace(day=1)
-        qs = qs.filter(borrow_date__gte=start_of_month, borrow_date__lte=today)
+        qs = qs.filter(day__gte=start_of_month, day__lte=today)
 
-    count = qs.count()
+    count = qs.aggregate(count=still_borrowed())["count"] or 0
     return Response({
         "range": range_type,
         "count": count,
@@ -1320,6 +1571,7 @@ def borrowed_stats(request):
 
 
 from rest_framework import generics
+from .analytics import invalidate_inventory_summary
 from .models import Transaction
 from .serializers import TransactionSerializer
 
@@ -1327,6 +1579,53 @@ class TransactionRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIV
     queryset = Transaction.objects.all()
     serializer_class = TransactionSerializer
     lookup_field = "pk"
+
+    def perform_update(self, serializer):
+        instance = serializer.instance
+        new_status = serializer.validated_data.get('status', instance.status)
+        if new_status != 'returned':
+            # an open loan is overdue as soon as its return date is in the past,
+            # not only once the nightly sweep gets to it
+            new_status = Transaction.open_status(serializer.validated_data.get('return_date', instance.return_date))
+        moved = serializer.validated_data.get('borrow_date', instance.borrow_date) != instance.borrow_date
+        this = Transaction.objects.filter(pk=instance.pk)
+        with db_transaction.atomic():
+            if instance.status == 'returned' and new_status != 'returned':
+                # reopening a loan lends its items out again, if nobody else has them
+                item_ids = list(
+                    Item.objects.select_for_update().filter(transactions=instance).values_list('id', flat=True)
+                )
+                unavailable = list(
+                    ActiveLoan.objects.filter(item_id__in=item_ids).values_list('item_id', flat=True)
+                )
+                if unavailable:
+                    raise ValidationError({"error": f"Items already borrowed: {unavailable}"})
+                ActiveLoan.open_for(instance, item_ids)
+            if moved:
+                # rollups are keyed by borrow day: take the loan out of the old
+                # day here and count it again under the new one after saving
+                record_transition(this, instance.status, None)
+            if new_status != instance.status:
+                if not moved:
+                    record_transition(this, instance.status, new_status)
+                if new_status == 'returned':
+                    ActiveLoan.close_for(instance)
+                mark_predictions_dirty(Item.objects.filter(transactions=instance).values_list('id', flat=True))
+            elif instance.manager_id:
+                # return_date edits still move the overdue / due-today counters
+                invalidate_inventory_summary([instance.manager_id])
+            old_return_date = instance.return_date
+            serializer.save(status=new_status)
+            if moved:
+                record_transition(this, None, new_status)
+            if instance.status != 'returned' and instance.return_date != old_return_date:
+                # reminders queued for the old date no-op when they fire
+                schedule_due_reminders([instance])
+
+    def perform_destroy(self, instance):
+        with db_transaction.atomic():
+            record_transition(Transaction.objects.filter(pk=instance.pk), instance.status, None)
+            instance.delete()
     
 from rest_framework.views import APIView
 from rest_framework.response import Response
@@ -1335,6 +1634,7 @@ from datetime import timedelta, datetime
 from django.db.models import Count
 from .models import Transaction
 from .serializers import TransactionSerializer
+from .analytics import resolve_manager, transaction_rollups
 import logging
 
 logger = logging.getLogger(__name__)
@@ -1342,104 +1642,14 @@ logger = logging.getLogger(__name__)
 class AnalyticsTransactionsView(APIView):
     def get(self, request):
         try:
-            # Get all relevant transactions (no filter here, filter in aggregations)
-            transactions = Transaction.objects.all()
-
-            # Calculate date ranges
-            today = dj_timezone.now().date()
-
-            # Daily aggregation: Last 7 days
-            start_daily = today - timedelta(days=6)
-            daily_data = {}
-            daily_transactions = [t for t in transactions if start_daily <= t.borrow_date <= today]
-            for t in daily_transactions:
-                day_key = t.borrow_date.strftime('%Y-%m-%d')
-                if day_key not in daily_data:
-                    daily_data[day_key] = {'count': 0, 'items': {}}
-                daily_data[day_key]['count'] += 1
-                for item in t.items.all():
-                    item_name = item.item_name
-                    daily_data[day_key]['items'][item_name] = daily_data[day_key]['items'].get(item_name, 0) + 1
-
-            daily_7_result = [
-                {
-                    'date': day_key,
-                    'count': data['count'],
-                    'top_items': [
-                        {'item': item, 'count': count}
-                        for item, count in sorted(
-                            data['items'].items(), key=lambda x: x[1], reverse=True
-                        )[:5]
-                    ]
-                }
-                for day_key, data in sorted(daily_data.items())  # Ascending: past to present
-            ]
-
-            # Weekly aggregation: Last 8 weeks
-            start_weekly = today - timedelta(weeks=7)  # 8 weeks including current
-            weekly_data = {}
-            weekly_transactions = [t for t in transactions if t.borrow_date >= start_weekly]
-            for t in weekly_transactions:
-                borrow_date = t.borrow_date
-                day = borrow_date.weekday()
-                week_start = borrow_date - timedelta(days=day)
-                week_key = week_start.strftime('%Y-%m-%d')
-
-                if week_key not in weekly_data:
-                    weekly_data[week_key] = {'count': 0, 'items': {}}
-                weekly_data[week_key]['count'] += 1
-                for item in t.items.all():
-                    item_name = item.item_name
-                    weekly_data[week_key]['items'][item_name] = weekly_data[week_key]['items'].get(item_name, 0) + 1
-
-            weekly_8_result = [
-                {
-                    'week_start': week_key,
-                    'count': data['count'],
-                    'top_items': [
-                        {'item': item, 'count': count}
-                        for item, count in sorted(
-                            data['items'].items(), key=lambda x: x[1], reverse=True
-                        )[:5]
-                    ]
-                }
-                for week_key, data in sorted(weekly_data.items())  # Ascending
-                if datetime.strptime(week_key, '%Y-%m-%d').date() >= start_weekly
-            ][:8]  # Ensure max 8
-
-            # Monthly aggregation: Last 12 months
-            start_monthly = today - relativedelta(months=11)  # 12 months including current
-            monthly_data = {}
-            monthly_transactions = [t for t in transactions if t.borrow_date >= start_monthly]
-            for t in monthly_transactions:
-                month_key = t.borrow_date.strftime('%Y-%m')
-                if month_key not in monthly_data:
-                    monthly_data[month_key] = {'count': 0, 'items': {}}
-                monthly_data[month_key]['count'] += 1
-                for item in t.items.all():
-                    item_name = item.item_name
-                    monthly_data[month_key]['items'][item_name] = monthly_data[month_key]['items'].get(item_name, 0) + 1
-
-            monthly_12_result = [
-                {
-                    'month': month_key,
-                    'count': data['count'],
-                    'top_items': [
-                        {'item': item, 'count': count}
-                        for item, count in sorted(
-                            data['items'].items(), key=lambda x: x[1], reverse=True
-                        )[:5]
-                    ]
-                }
-                for month_key, data in sorted(monthly_data.items())  # Ascending
-                if datetime.strptime(month_key, '%Y-%m').date() >= start_monthly.replace(day=1)
-            ][:12]  # Ensure max 12
+            manager = resolve_manager(request.user)
+            if manager is None:
+                return Response({"error": "Unauthorized role or missing manager."},
+                                status=status.HTTP_403_FORBIDDEN)
 
-            return Response({
-                'daily_7': daily_7_result,
-                'weekly_8': weekly_8_result,
-                'monthly_12': monthly_12_result
-            }, status=status.HTTP_200_OK)
+            # Buckets and their top items are grouped in SQL, scoped to the manager
+            rollups = transaction_rollups(manager, dj_timezone.now().date())
+            return Response(rollups, status=status.HTTP_200_OK)
 
         except Exception as e:
             logger.error(f"Error in AnalyticsTransactionsView: {str(e)}")
@@ -1458,6 +1668,7 @@ from datetime import timedelta
 from django.db.models import Q, Prefetch
 from .models import Transaction, Item
 from .serializers import DamagedOverdueReportSerializer  # FIXED: Import the serializer
+from .analytics import overdue_q
 import logging
 
 logger = logging.getLogger(__name__)
@@ -1471,12 +1682,11 @@ class DamagedOverdueReportView(APIView):  # FIXED: Proper APIView
             date_from = request.data.get('dateFrom')
             date_to = request.data.get('dateTo')
 
-            today = dj_timezone.now().date()
+            overdue = overdue_q(dj_timezone.localdate())
 
             # Base queryset
             queryset = Transaction.objects.filter(
-                Q(status='returned', items__condition__iexact='damaged') |
-                Q(status='borrowed', return_date__lt=today)
+                Q(status='returned', items__condition__iexact='damaged') | overdue
             ).distinct().prefetch_related(
                 Prefetch('items', queryset=Item.objects.only('item_name', 'condition')),
                 'borrower'
@@ -1495,7 +1705,7 @@ class DamagedOverdueReportView(APIView):  # FIXED: Proper APIView
                 if status_filter == 'damaged':
                     queryset = queryset.filter(status='returned', items__condition__iexact='damaged')
                 elif status_filter == 'overdue':
-                    queryset = queryset.filter(status='borrowed', return_date__lt=today)
+                    queryset = queryset.filter(overdue)
 
             # Apply date range
             from datetime import datetime, timedelta
@@ -1621,7 +1831,9 @@ from rest_framework.response import Response
 from rest_framework import status
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework.permissions import IsAuthenticated
-from .models import Item, Transaction
+from .models import Item, PredictiveItemCondition, Transaction
+from .serializers import PredictiveItemSerializer
+from .analytics import mark_predictions_dirty, refresh_predictions
 
 # If you see this anywhere in views.py, fix it:
 # from sympy import Q   <-- WRONG
@@ -1631,7 +1843,9 @@ from .models import Item, Transaction
 class PredictiveDamageInsightView(APIView):
     """
     Rule-based prediction: estimates which items are at risk of damage soon.
-    Computes per-item risk using recent borrows, overdue history, and current condition.
+    Serves the stored PredictiveItemCondition rows, which the
+    recompute_item_predictions task refreshes from recent borrows, overdue
+    history, and current condition.
     """
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthenticated]
@@ -1647,50 +1861,19 @@ class PredictiveDamageInsightView(APIView):
                 return Response({"error": "Unauthorized role or missing manager."},
                                 status=status.HTTP_403_FORBIDDEN)
 
-            today = dj_timezone.now().date()
-            ninety_days_ago = today - timedelta(days=90)
-            now_iso = dj_timezone.now().isoformat()
-
-            results = []
-            for item in items_qs:
-                tx_qs = Transaction.objects.filter(items=item)
-
-                total_borrows = tx_qs.count()
-                recent_borrows = tx_qs.filter(borrow_date__gte=ninety_days_ago).count()
-                overdue_count  = tx_qs.filter(status="overdue").count()
-
-                # Use current item condition as a damage signal
-                cond_text = (item.condition or "").lower()
-                damage_flag = any(k in cond_text for k in ["damaged", "damage", "broken", "crack", "dent", "loose"])
-
-                # Heuristic scoring
-                risk = 0.0
-                if recent_borrows > 3:  # heavy recent usage
-                    risk += 0.30
-                if overdue_count > 1:   # mishandling risk
-                    risk += 0.20
-                if damage_flag:         # already showing issues
-                    risk += 0.40
-                if total_borrows > 10:  # wear/tear
-                    risk += 0.10
-                risk = min(1.0, risk)
-
-                reason = (
-                    f"Total borrows: {total_borrows}, "
-                    f"Recent(90d): {recent_borrows}, "
-                    f"Overdue: {overdue_count}, "
-                    f"Current condition: {item.condition or 'N/A'}"
-                )
-
-                results.append({
-                    "item_name": item.item_name,
-                    "condition": item.condition,
-                    "predicted_risk": risk,
-                    "reason": reason,
-                    "last_checked": now_iso,
-                })
-
-            results.sort(key=lambda x: x["predicted_risk"], reverse=True)
+            # Items that have never been scored get a prediction now; everything
+            # else is kept fresh by the recompute_item_predictions task.
+            missing = list(items_qs.filter(prediction__isnull=True).values_list("id", flat=True))
+            if missing:
+                mark_predictions_dirty(missing)
+                refresh_predictions(list(PredictiveItemCondition.objects.filter(item_id__in=missing)))
+
+            predictions = (
+                PredictiveItemCondition.objects.filter(item__in=items_qs)
+                .select_related("item")
+                .order_by("-predicted_risk", "item__item_name")
+            )
+            results = PredictiveItemSerializer(predictions, many=True).data
             return Response(results, status=status.HTTP_200_OK)
 
         except Exception as e:
@@ -1734,7 +1917,7 @@ class TransactionReportView(APIView):
             # --- Condition filter ---
             if condition_filter and condition_filter != 'all':
                 if condition_filter == 'overdue':
-                    queryset = queryset.filter(status='borrowed', return_date__lt=today)
+                    queryset = queryset.filter(overdue_q(today))
                 else:
                     queryset = queryset.filter(
                         status='returned',
@@ -1789,7 +1972,7 @@ class TransactionReportView(APIView):
             for tx in queryset:
                 serializer = TransactionReportSerializer(tx, context={'request': request})
                 data = serializer.data
-                if tx.status == 'borrowed' and tx.return_date and tx.return_date < today:
+                if tx.status in ('borrowed', 'overdue') and tx.return_date and tx.return_date < today:
                     data['daysPastDue'] = (today - tx.return_date).days
                 processed_data.append(data)
 
@@ -1830,9 +2013,9 @@ class SimpleItemListCreateAPIView(generics.ListCreateAPIView):
             return Item.objects.filter(id__in=[item['id'] for item in cached_data])
 
         if user.role == 'user_web':
-            queryset = Item.objects.filter(manager=user).only('id', 'item_name')
+            queryset = Item.objects.filter(manager=user).only('id', 'item_name', 'image', 'image_status', 'image_renditions')
         elif user.manager:
-            queryset = Item.objects.filter(manager=user.manager).only('id', 'item_name')
+            queryset = Item.objects.filter(manager=user.manager).only('id', 'item_name', 'image', 'image_status', 'image_renditions')
         else:
             queryset = Item.objects.none()
 
@@ -1843,37 +2026,13 @@ class SimpleItemListCreateAPIView(generics.ListCreateAPIView):
         return queryset
 
     def perform_create(self, serializer):
-        from PIL import Image
-        from rembg import remove
-        from io import BytesIO
-
         image_file = self.request.FILES.get('image')
-        new_image = None
-        if image_file:
-            try:
-                if image_file.size > 5 * 1024 * 1024:
-                    logger.error("Image size exceeds 5MB")
-                    return Response(
-                        {"error": "Image size exceeds 5MB"},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-
-                input_img = Image.open(image_file).convert("RGBA")
-                input_img.thumbnail((800, 800), Image.Resampling.LANCZOS)
-                output_img = remove(input_img)
-                temp_buffer = BytesIO()
-                output_img.save(temp_buffer, format="PNG")
-                temp_buffer.seek(0)
-                new_image = ContentFile(
-                    temp_buffer.read(),
-                    name=f"{image_file.name.rsplit('.', 1)[0]}.png"
-                )
-            except Exception as e:
-                logger.error(f"Error removing background for new item: {str(e)}")
-                return Response(
-                    {"error": f"Failed to process image: {str(e)}"},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+        if image_file and image_file.size > 5 * 1024 * 1024:
+            logger.error("Image size exceeds 5MB")
+            return Response(
+                {"error": "Image size exceeds 5MB"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
         manager = self.request.user if self.request.user.role == 'user_web' else self.request.user.manager
         if not manager:
@@ -1883,13 +2042,18 @@ class SimpleItemListCreateAPIView(generics.ListCreateAPIView):
                 status=status.HTTP_403_FORBIDDEN
             )
 
-        instance = serializer.save(manager=manager, image=new_image if new_image else None)
+        if image_file:
+            # Store the upload now; background removal runs off the request path
+            instance = serializer.save(manager=manager, image=image_file, image_status='processing')
+            schedule_item_image(instance.id)
+        else:
+            instance = serializer.save(manager=manager, image=None)
 
         cache_key = f"simple_items_{self.request.user.id}_{self.request.user.role}"
         cache.delete(cache_key)
         logger.info(f"Invalidated cache for user={self.request.user.username}")
 
-        if new_image:
-            logger.info(f"Background removed for item {instance.id}")
+        if image_file:
+            logger.info(f"Background removal queued for item {instance.id}")
 
         return Response(serializer.data, status=status.HTTP_201_CREATED)
\ No newline at end of file
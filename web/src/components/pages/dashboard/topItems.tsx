@@ -86,15 +86,21 @@ export default function PredictedTopItemsRow() {
   };
 
   const fetchAllItems = async (): Promise<DbItem[]> => {
-    const res = await fetch(`${API_BASE_URL}/api/items/?page=1&page_size=1000`, {
-      headers: { "Content-Type": "application/json", ...getAuthHeaders() },
-      cache: "no-store",
-    });
-    if (!res.ok) throw new Error(`Items: ${res.status}`);
-    const data = await res.json();
-    if (Array.isArray(data)) return data as DbItem[];
-    if (Array.isArray(data.results)) return data.results as DbItem[];
-    return [];
+    // page_size is capped server-side (API_MAX_PAGE_SIZE), so follow `next` to the last page
+    const all: DbItem[] = [];
+    let url: string | null = `${API_BASE_URL}/api/items/?page_size=500&history=0`;
+    while (url) {
+      const res = await fetch(url, {
+        headers: { "Content-Type": "application/json", ...getAuthHeaders() },
+        cache: "no-store",
+      });
+      if (!res.ok) throw new Error(`Items: ${res.status}`);
+      const data = await res.json();
+      if (Array.isArray(data)) return data as DbItem[];
+      if (Array.isArray(data.results)) all.push(...(data.results as DbItem[]));
+      url = data.next ?? null;
+    }
+    return all;
   };
 
   const refreshAll = async () => {